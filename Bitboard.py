@@ -0,0 +1,83 @@
+try:
+    popcount = int.bit_count
+except AttributeError:
+    # Python < 3.10
+    def popcount(mask):
+        return bin(mask).count('1')
+
+
+class EdgeMasks(object):
+    """
+    Precomputed masks of a w * h board. Cell (y, x) is bit y * w + x.
+    """
+    def __init__(self, w, h):
+        self.w = w
+        self.h = h
+        self.full = (1 << (w * h)) - 1
+        left_col = 0
+        for y in range(h):
+            left_col |= 1 << (y * w)
+        self.left_col = left_col
+        self.right_col = left_col << (w - 1)
+        self.not_left_col = self.full & ~left_col
+        self.not_right_col = self.full & ~self.right_col
+
+
+_edge_masks = {}
+
+
+def edge_masks(w, h):
+    masks = _edge_masks.get((w, h))
+    if masks is None:
+        masks = EdgeMasks(w, h)
+        _edge_masks[(w, h)] = masks
+    return masks
+
+
+class Bitboard(object):
+    """
+    Board represented as Python int bitmasks, cell (y, x) is bit y * w + x.
+
+    Only the search reads it, flood filling through the cells without a body.
+
+    :param w: Width of the map
+    :type w: int
+    :param h: Height of the map
+    :type h: int
+    """
+    def __init__(self, w, h):
+        self.w = w
+        self.h = h
+        self.masks = edge_masks(w, h)
+        self.bodies = 0 # every snake body cell
+
+    @classmethod
+    def from_state(cls, game):
+        w = game.w
+        h = game.h
+        bb = cls(w, h)
+        bodies = 0
+        for (y, x) in game.bodies.tolist() + game.you.body.tolist():
+            if 0 <= y < h and 0 <= x < w:
+                bodies |= 1 << (y * w + x)
+        bb.bodies = bodies
+        return bb
+
+    def neighbours(self, mask):
+        masks = self.masks
+        return (((mask << self.w) & masks.full)
+                | (mask >> self.w)
+                | ((mask & masks.not_left_col) >> 1)
+                | ((mask & masks.not_right_col) << 1))
+
+    def flood_layers(self, seed, passable):
+        '''
+        Expand the seed through passable cells one step at a time
+        :return: generator of the newly reached cells of every step, starting with the seed
+        '''
+        visited = seed
+        frontier = seed
+        while frontier:
+            yield frontier
+            frontier = self.neighbours(frontier) & passable & ~visited
+            visited |= frontier
@@ -0,0 +1,200 @@
+import sys
+import threading
+from collections import deque
+
+import util
+from Bitboard import Bitboard
+
+
+class BoardCache(object):
+    """
+    Board of one game kept between turns and updated from the differences.
+
+    Between two turns a snake moves its head one cell and drops its tail
+    unless it ate, so only the cells of the new heads, the dropped tails, the
+    grown tails, the food and the snakes which died change. Every body is kept
+    as a deque of (y, x), head first, and every cell counts the body parts on
+    it, so an update costs a few cells per snake whatever the board size and
+    the body lengths. A payload which does not follow from the previous turn
+    (a missed turn, a new snake, a body which did not move by one cell)
+    rebuilds the board from scratch.
+
+    The grid is the same as util.construct_board, the bitboard the same as
+    Bitboard.from_state. The bitboard is only built when asked for.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.turn = None
+        self.w = None
+        self.h = None
+        self.states = None
+        self.counts = None # body parts of board.snakes on every cell, by y * w + x
+        self.mine = None # body parts of my snake on every cell, by y * w + x
+        self.snakes = {} # snake id -> deque of (y, x) of board.snakes
+        self.you = None # deque of (y, x) of my snake
+        self.food = set()
+        self.bodies = 0 # bitmask of the cells with a body part
+        self.marked = None # my head and tail when they were last marked
+        self.updates = 0
+        self.rebuilds = 0
+
+    def update(self, game):
+        """
+        Move the board to the turn of the game state
+
+        :param game: The game state of the new turn
+        :type game: GameState.GameState
+        :return: The grid of the turn, as util.construct_board, read only and valid until the next update
+        :rtype: numpy.ndarray
+        """
+        with self.lock:
+            if self.__diff(game):
+                self.updates += 1
+            else:
+                self.__rebuild(game)
+                self.rebuilds += 1
+            self.turn = game.turn
+            self.marked = (game.you.head, game.you.tail)
+            # No copy, the requests of a game come one after the other
+            states = self.states.view()
+            states.setflags(write=False)
+            return states
+
+    def bitboard(self):
+        # Bitboard of the last turn updated, from the cached bodies
+        with self.lock:
+            bb = Bitboard(self.w, self.h)
+            bb.bodies = self.bodies
+            return bb
+
+    def nbytes(self):
+        # Size of the arrays and bodies kept, the (y, x) tuples are shared with the payload parsing
+        if self.states is None:
+            return sys.getsizeof(self)
+        bodies = list(self.snakes.values()) + [self.you]
+        return (sys.getsizeof(self) + self.states.nbytes + sys.getsizeof(self.counts) + sys.getsizeof(self.mine)
+                + sum(sys.getsizeof(body) for body in bodies) + sys.getsizeof(self.food))
+
+    def __rebuild(self, game):
+        w = game.w
+        h = game.h
+        self.w = w
+        self.h = h
+        self.states = util.construct_board(game)
+        self.counts = [0] * (w * h)
+        self.mine = [0] * (w * h)
+        self.snakes = {}
+        self.bodies = 0
+        for snake in game.snakes:
+            body = deque(map(tuple, snake.body.tolist()))
+            self.snakes[snake.id] = body
+            self.__add(self.counts, body)
+        self.you = deque(map(tuple, game.you.body.tolist()))
+        self.__add(self.mine, self.you)
+        self.food = set(map(tuple, game.food.tolist()))
+        for c in range(w * h):
+            if self.counts[c] or self.mine[c]:
+                self.bodies |= 1 << c
+
+    def __add(self, counts, body):
+        for (y, x) in body:
+            if 0 <= y < self.h and 0 <= x < self.w:
+                counts[y * self.w + x] += 1
+
+    def __diff(self, game):
+        # Apply the changes from the previous turn, False without any change when they do not follow from it
+        if self.states is None or game.w != self.w or game.h != self.h or game.turn != self.turn + 1:
+            return False
+
+        moves = []
+        for snake in game.snakes:
+            body = self.snakes.get(snake.id)
+            if body is None:
+                return False
+            move = self.__move(body, snake)
+            if move is None:
+                return False
+            moves.append((self.counts, body, move))
+        my_move = self.__move(self.you, game.you)
+        if my_move is None:
+            return False
+        moves.append((self.mine, self.you, my_move))
+
+        changed = set()
+        alive = set(snake.id for snake in game.snakes)
+        for snake_id in [snake_id for snake_id in self.snakes if snake_id not in alive]:
+            # Eliminated, the whole body goes
+            body = self.snakes.pop(snake_id)
+            for cell in body:
+                self.__count(self.counts, cell, -1, changed)
+        for counts, body, (head, grown) in moves:
+            body.appendleft(head)
+            self.__count(counts, head, 1, changed)
+            tail = body.pop()
+            self.__count(counts, tail, -1, changed)
+            for cell in grown:
+                body.append(cell)
+                self.__count(counts, cell, 1, changed)
+
+        food = set(map(tuple, game.food.tolist()))
+        changed.update(food ^ self.food)
+        self.food = food
+
+        # My head and tail are marked on top of the bodies
+        you = game.you
+        changed.add(you.head)
+        changed.add(you.tail)
+        changed.update(self.marked)
+        cells = [(y, x) for (y, x) in changed if 0 <= y < self.h and 0 <= x < self.w]
+        if cells:
+            ys, xs = zip(*cells)
+            self.states[ys, xs] = [self.__mark(y, x, you) for (y, x) in cells]
+        return True
+
+    def __move(self, body, snake):
+        """
+        Head and grown tail cells turning the body into the one of the snake, None if it did not move by one cell
+
+        :param body: The body of the previous turn
+        :type body: collections.deque
+        :param snake: The snake in the new turn
+        :type snake: GameState.Snake
+        :return: (new head, cells appended after the tail moved)
+        :rtype: tuple
+        """
+        n = len(body)
+        m = len(snake.body)
+        if n < 3 or m not in (n, n + 1):
+            return None
+        # Every part moved forward by one, the last moved part is the previous one before the tail
+        neck, last_moved = snake.body[1:n:n - 2].tolist()
+        if (neck[0], neck[1]) != body[0] or (last_moved[0], last_moved[1]) != body[-2]:
+            return None
+        grown = [snake.tail] if m > n else []
+        return snake.head, grown
+
+    def __count(self, counts, cell, n, changed):
+        y, x = cell
+        if 0 <= y < self.h and 0 <= x < self.w:
+            counts[y * self.w + x] += n
+            changed.add(cell)
+
+    def __mark(self, y, x, you):
+        # Value of the cell in util.construct_board, last mark wins, and its body bit
+        c = y * self.w + x
+        if self.mine[c] or self.counts[c]:
+            self.bodies |= 1 << c
+        else:
+            self.bodies &= ~(1 << c)
+
+        if len(you.body) > 3 and (y, x) == you.tail:
+            return 4
+        elif (y, x) == you.head:
+            return 3
+        elif self.mine[c]:
+            return 1
+        elif (y, x) in self.food:
+            return 2
+        elif self.counts[c]:
+            return 1
+        return 0
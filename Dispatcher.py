@@ -0,0 +1,199 @@
+import bisect
+import hashlib
+import http.client
+import json
+import queue
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+import cherrypy
+
+import util
+from Metrics import Metrics
+from SessionStore import CHECKPOINT_HEADER
+
+# Seconds a worker has to answer the requests without a game timeout
+DEFAULT_TIMEOUT = 5.0
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing(object):
+    """
+    Consistent hashing of keys onto nodes.
+
+    Every node owns replicas points of the ring and a key goes to the node of
+    the first point after its hash, so adding or removing a node only moves
+    the keys of its own points.
+
+    :param nodes: Names of the nodes
+    :type nodes: list
+    :param replicas: Points of every node
+    :type replicas: int
+    """
+    def __init__(self, nodes, replicas=64):
+        self.points = sorted((_hash("{}#{}".format(node, i)), node) for node in nodes for i in range(replicas))
+        self.hashes = [h for (h, _) in self.points]
+        self.size = len(set(nodes))
+
+    def nodes(self, key):
+        # Distinct nodes in the order the key falls back to them, its own node first
+        i = bisect.bisect(self.hashes, _hash(key))
+        found = []
+        for j in range(len(self.points)):
+            node = self.points[(i + j) % len(self.points)][1]
+            if node not in found:
+                found.append(node)
+                if len(found) == self.size:
+                    break
+        return found
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a Unix domain socket.
+    """
+    def __init__(self, path, timeout=DEFAULT_TIMEOUT):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class Dispatcher(object):
+    """
+    Front server forwarding the requests of every game to the worker owning it.
+
+    Games are consistent hashed by util.unique_id onto the workers, so every
+    request of a game reaches the worker holding its session. The checkpoint
+    of a session returned by the worker with every response is kept here and
+    sent with the next request of the game, so when its worker restarts or
+    fails, the next worker of the ring continues the game where it stopped.
+    A request of a game is given up at the game timeout minus the network
+    margin, the answer would come too late for the engine anyway.
+
+    :param paths: Unix socket of every worker
+    :type paths: list
+    :param ttl: Seconds a checkpoint of an idle game is kept
+    :type ttl: float
+    :param max_sessions: The maximum number of checkpoints kept
+    :type max_sessions: int
+    :param network_margin_ms: Milliseconds of the game timeout kept for the network round trip
+    :type network_margin_ms: int
+    """
+    def __init__(self, paths, ttl=600.0, max_sessions=10000, network_margin_ms=100):
+        self.paths = paths
+        self.ring = HashRing(list(range(len(paths))))
+        self.pools = [queue.LifoQueue() for _ in paths]
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.checkpoints = OrderedDict()
+        self.lock = threading.Lock()
+        self.network_margin_ms = network_margin_ms
+        self.failovers = 0
+        self.stage_metrics = Metrics()
+        self.stage_metrics.gauge("battlesnake_dispatch_failovers", "Requests a worker failed to answer, sent to the next one.", lambda: self.failovers)
+
+    @cherrypy.expose
+    def index(self):
+        return self.__forward("GET", "/", None, None)
+
+    @cherrypy.expose
+    def start(self):
+        return self.__game("/start")
+
+    @cherrypy.expose
+    def move(self):
+        return self.__game("/move")
+
+    @cherrypy.expose
+    def end(self):
+        return self.__game("/end")
+
+    @cherrypy.expose
+    def metrics(self, worker=0):
+        # Metrics of one worker, followed by the gauges of the dispatcher
+        payload = self.__forward("GET", "/metrics", None, None, [int(worker)])
+        return payload + self.stage_metrics.render_gauges().encode()
+
+    def __game(self, path):
+        body = cherrypy.request.body.read()
+        data = json.loads(body)
+        key = util.unique_id(data)
+        # Same budget as the move of the worker, see Battlesnake.handle_move
+        timeout = (data['game'].get('timeout', 500) - self.network_margin_ms) / 1000.0
+        with self.lock:
+            kept = self.checkpoints.get(key)
+        # "null" until the first response of the game, asks the worker for its checkpoint
+        checkpoint = kept[0] if kept is not None else "null"
+        return self.__forward("POST", path, body, checkpoint, self.ring.nodes(key), key, timeout)
+
+    def __forward(self, method, path, body, checkpoint, nodes=None, key=None, timeout=DEFAULT_TIMEOUT):
+        # Send the request to the first node answering, each node is tried once until the timeout
+        deadline = time.monotonic() + timeout
+        headers = {"Content-Type": cherrypy.request.headers.get("Content-Type", "application/json")}
+        if checkpoint is not None:
+            headers[CHECKPOINT_HEADER] = checkpoint
+        for n in (nodes if nodes is not None else self.ring.nodes(path)):
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                status, response_headers, payload = self.__request(n, method, path, body, headers, left)
+            except (OSError, http.client.HTTPException):
+                with self.lock:
+                    self.failovers += 1
+                continue
+            if key is not None:
+                self.__keep(key, path, response_headers.get(CHECKPOINT_HEADER))
+            cherrypy.response.status = status
+            cherrypy.response.headers["Content-Type"] = response_headers.get("Content-Type", "application/json")
+            return payload
+        raise cherrypy.HTTPError(503, "No worker answered")
+
+    def __request(self, n, method, path, body, headers, timeout):
+        # A pooled connection may have been closed by a worker restart, retry once on a new one
+        for fresh in (False, True):
+            try:
+                connection = self.pools[n].get_nowait() if not fresh else None
+            except queue.Empty:
+                connection = None
+            if connection is None:
+                fresh = True
+                connection = UnixHTTPConnection(self.paths[n], timeout)
+            else:
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                payload = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                # A worker too slow for the timeout is not retried, the time is spent
+                if fresh or isinstance(e, socket.timeout):
+                    raise
+                continue
+            self.pools[n].put(connection)
+            return response.status, response.headers, payload
+
+    def __keep(self, key, path, checkpoint):
+        now = time.monotonic()
+        with self.lock:
+            self.checkpoints.pop(key, None)
+            if path != "/end" and checkpoint is not None:
+                self.checkpoints[key] = (checkpoint, now)
+            # Oldest first, stops at the first one kept
+            while self.checkpoints:
+                (_, seen) = next(iter(self.checkpoints.values()))
+                if len(self.checkpoints) <= self.max_sessions and now - seen <= self.ttl:
+                    break
+                self.checkpoints.popitem(last=False)
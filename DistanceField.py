@@ -0,0 +1,218 @@
+import numpy as np
+
+import neighbours
+import util
+from neighbours import DELTAS
+
+
+class DistanceField(object):
+    """
+    Breadth first distances from one or more source cells to every cell.
+
+    Cells are linear indices y * w + x. The frontier is a preallocated list
+    read with a moving index, so the frontier doubles as the visiting order.
+    With several sources every cell also records which source reached it
+    first, ties going to the earlier source.
+
+    :param free: Passable cells, indexed by linear index
+    :type free: list
+    :param w: Width of the board
+    :type w: int
+    :param h: Height of the board
+    :type h: int
+    :param sources: (y, x) of the sources, they do not need to be passable
+    :type sources: list
+    :param max_depth: Stop expanding at this distance, None for the whole board
+    :type max_depth: int
+    """
+    def __init__(self, free, w, h, sources, max_depth=None):
+        self.w = w
+        self.h = h
+        n = w * h
+        dist = [-1] * n
+        parent = [-1] * n # direction moved to enter the cell
+        first = [-1] * n # first direction moved from the source
+        source = [-1] * n
+        order = [0] * n
+        size = 0
+        for k, (y, x) in enumerate(sources):
+            if 0 <= y < h and 0 <= x < w and dist[y * w + x] == -1:
+                c = y * w + x
+                dist[c] = 0
+                source[c] = k
+                order[size] = c
+                size += 1
+
+        depth_limit = n if max_depth is None else max_depth
+        nears = neighbours.table(w, h).rows
+        i = 0
+        while i < size:
+            c = order[i]
+            i += 1
+            d = dist[c]
+            if d >= depth_limit:
+                continue
+            for a, nc in enumerate(nears[c]):
+                if nc != neighbours.OFF_BOARD and free[nc] and dist[nc] == -1:
+                    dist[nc] = d + 1
+                    parent[nc] = a
+                    first[nc] = a if d == 0 else first[c]
+                    source[nc] = source[c]
+                    order[size] = nc
+                    size += 1
+
+        self.dist = dist
+        self.parent = parent
+        self.first = first
+        self.source = source
+        self.order = order[:size]
+        self._rank = None
+
+    @property
+    def rank(self):
+        # Position of every cell in the visiting order, -1 if not visited
+        if self._rank is None:
+            rank = [-1] * (self.w * self.h)
+            for i, c in enumerate(self.order):
+                rank[c] = i
+            self._rank = rank
+        return self._rank
+
+    def distance(self, y, x):
+        # -1 if the cell is out of the board or unreachable
+        if y < 0 or x < 0 or y >= self.h or x >= self.w:
+            return -1
+        return self.dist[y * self.w + x]
+
+    def first_move(self, y, x):
+        # Direction of the first move of a shortest path to the cell, -1 if unreachable
+        if self.distance(y, x) <= 0:
+            return -1
+        return self.first[y * self.w + x]
+
+    def path(self, y, x):
+        # Directions of a shortest path to the cell, following the parents back to the source
+        if self.distance(y, x) < 0:
+            return []
+        path = []
+        c = y * self.w + x
+        while self.dist[c] > 0:
+            a = self.parent[c]
+            path.append(a)
+            dy, dx = DELTAS[a]
+            c -= dy * self.w + dx
+        path.reverse()
+        return path
+
+    def distances(self):
+        # (h, w) int32 array of the distances
+        return np.array(self.dist, dtype=np.int32).reshape(self.h, self.w)
+
+
+class DistanceFields(object):
+    """
+    Distance fields of one turn, each computed on first use.
+
+    :param game: The game state of the turn
+    :type game: GameState.GameState
+    :param states: The board constructed by util.construct_board
+    :type states: numpy.ndarray
+    """
+    def __init__(self, game, states):
+        self.game = game
+        self.states = states
+        # Same passable cells as the route searches
+        self.free = ((states != 1) & (states != 3)).ravel().tolist()
+        self._next_free = None
+        self._mine = None
+        self._opponents = {}
+        self._food = None
+
+    @property
+    def mine(self):
+        # From my head
+        if self._mine is None:
+            self._mine = DistanceField(self.free, self.game.w, self.game.h, [self.game.you.head])
+        return self._mine
+
+    @property
+    def next_free(self):
+        # Passable cells of the next move, also the tails which move away this turn
+        if self._next_free is None:
+            free = list(self.free)
+            for c in util.moving_tails(self.game):
+                free[c] = True
+            self._next_free = free
+        return self._next_free
+
+    def opponent(self, snake, max_depth=None, next_move=False):
+        # From the head of an opponent, limited to max_depth moves, over next_free with next_move
+        key = (snake.index, max_depth, next_move)
+        if key not in self._opponents:
+            free = self.next_free if next_move else self.free
+            self._opponents[key] = DistanceField(free, self.game.w, self.game.h, [snake.head], max_depth)
+        return self._opponents[key]
+
+    @property
+    def food(self):
+        # (y, x) of the food visible on the board, food under my body is hidden
+        if self._food is None:
+            ys, xs = np.nonzero(self.states == 2)
+            self._food = list(zip(ys.tolist(), xs.tolist()))
+        return self._food
+
+    def closest_food(self):
+        """
+        Food chosen by the food search: the first food visited from my head
+        which still has an unvisited neighbour when it is expanded, so food
+        in a dead end which the search already went around is passed over.
+
+        :return: (y, x) of the food, None if there is none
+        :rtype: tuple
+        """
+        field = self.mine
+        w = self.game.w
+        nears = neighbours.table(w, self.game.h).rows
+        food = set(y * w + x for (y, x) in self.game.food.tolist())
+        rank = field.rank
+        for i, c in enumerate(field.order):
+            if c not in food:
+                continue
+            for nc in nears[c]:
+                if nc == neighbours.OFF_BOARD or field.dist[nc] < 0:
+                    continue
+                if field.parent[nc] < 0:
+                    continue # my head
+                # Unvisited until the cell it was discovered from is expanded
+                pdy, pdx = DELTAS[field.parent[nc]]
+                if rank[nc - pdy * w - pdx] >= i:
+                    return divmod(c, w)
+        return None
+
+    def food_signals(self):
+        """
+        Food signal for four directions (0-1), same as util.food_signals,
+        including its row and column ranges: down and left stop two cells
+        before the head, and wrap around at the board edge like the slices.
+
+        :return: (up, down, left, right) food signals
+        :rtype: tuple
+        """
+        head_y, head_x = self.game.you.head
+        h = self.game.h
+        w = self.game.w
+        up = range(*slice(head_y + 1, h).indices(h))
+        down = range(*slice(0, head_y - 1).indices(h))
+        left = range(*slice(0, head_x - 1).indices(w))
+        right = range(*slice(head_x + 1, w).indices(w))
+        up_food = down_food = left_food = right_food = 0
+        for (y, x) in self.food:
+            if y in up:
+                up_food = 1
+            if y in down:
+                down_food = 1
+            if x in left:
+                left_food = 1
+            if x in right:
+                right_food = 1
+        return up_food, down_food, left_food, right_food
@@ -1,12 +1,4 @@
-import util
 import config as cf
-import numpy as np
-
-class State(object):
-    def __init__(self, pos, direct, parent):
-        self.pos = pos
-        self.direct = direct
-        self.parent = parent
 
 class FoodStrategy(object):
     def __init__(self, raw_config):
@@ -15,26 +7,19 @@ class FoodStrategy(object):
         self.num_actions = config.num_actions
         self.small_area_threshold = 11
 
-    def start(self, data):
+    def start(self, data, session):
         pass
 
-    def end(self, data):
+    def end(self, data, session):
         pass
 
-    def move(self, data):
+    def move(self, data, ctx):
         # 0 = empty
         # 1 = barrier
         # 2 = food
         # 3 = head
-        board = data['board']
-        h = board['height']
-        w = board['width']
-        you = data['you']
-        head = you['head']
-
-        states = data['states']
-        block_arr = data['block_arr']
-        routes = data['routes']
+        block_arr = ctx.block_arr
+        routes = ctx.routes
 
         # Choose a random direction to move in
         possible_moves = ["up", "down", "left", "right"]
@@ -48,17 +33,17 @@ class FoodStrategy(object):
                     max_routes_dir = a
                     max_routes = routes[a]
 
-        foods = [] # list of tuple
-        if 'food' in board:
-            for pos in board['food']:
-                foods.append((pos['y'], pos['x']))
+        if ctx.expired():
+            # no time left to search for food, the max routes direction is the best so far
+            return possible_moves[max_routes_dir]
 
-        closest_food = self.find_closest_food(head['y'], head['x'], h, w, foods, states)
+        with ctx.timed('distance_field'):
+            closest_food = ctx.fields.closest_food()
         if closest_food is None:
             # cannot reach any food
             return possible_moves[max_routes_dir]
 
-        path = self.path_to_closest_food(head['y'], head['x'], h, w, closest_food, states) # list of direction
+        path = ctx.fields.mine.path(*closest_food) # list of direction
 
         ideal_move = path[0]
         if block_arr[ideal_move]:
@@ -72,62 +57,3 @@ class FoodStrategy(object):
             ideal_move = max_routes_dir
 
         return possible_moves[ideal_move]
-
-    def find_closest_food(self, head_y, head_x, h, w, foods, states):
-        queue = []
-        visited = set()
-        queue.append((head_y, head_x))
-        visited.add((head_y, head_x))
-        while len(queue) != 0:
-            pos = queue.pop(0)
-            nears, _ = self.getAvailableNext(pos, h, w, states)
-            for near in nears:
-                if near in visited:
-                    continue
-                if pos in foods:
-                    return pos
-                queue.append(near)
-                visited.add(near)
-        return None # cannot reach any food
-
-    def path_to_closest_food(self, head_y, head_x, h, w, closest_food, states):
-        # BFS to find the closest route
-        visited = set()
-        queue = []
-        visited.add((head_y, head_x))
-        queue.append(State(pos=(head_y, head_x), direct=None, parent=None))
-        while len(queue) > 0:
-            s = queue.pop(0)
-            next_pos, next_dirs = self.getAvailableNext(s.pos, h, w, states)
-            for npos, nd in zip(next_pos, next_dirs):
-                if npos in visited:
-                    continue
-                if npos == closest_food:
-                    # Break the loop and return the path
-                    path = []
-                    cur = State(pos=npos, direct=nd, parent=s)
-                    while cur.direct is not None:
-                        path.append(cur.direct)
-                        cur = cur.parent
-                    path.reverse()
-                    return path
-                queue.append(State(pos=npos, direct=nd, parent=s))
-                visited.add(npos)
-        return []
-
-    def getAvailableNext(self, pos, h, w, states):
-        possible_nears = []
-        possible_dirs = []
-        if util.isInsideBoundary(pos[0] + 1, pos[1], w, h) and states[pos[0] + 1, pos[1]] not in (1, 3):
-            possible_nears.append((pos[0] + 1, pos[1]))
-            possible_dirs.append(0)
-        if util.isInsideBoundary(pos[0] - 1, pos[1], w, h) and states[pos[0] - 1, pos[1]] not in (1, 3):
-            possible_nears.append((pos[0] - 1, pos[1]))
-            possible_dirs.append(1)
-        if util.isInsideBoundary(pos[0], pos[1] - 1, w, h) and states[pos[0], pos[1] - 1] not in (1, 3):
-            possible_nears.append((pos[0], pos[1] - 1))
-            possible_dirs.append(2)
-        if util.isInsideBoundary(pos[0], pos[1] + 1, w, h) and states[pos[0], pos[1] + 1] not in (1, 3):
-            possible_nears.append((pos[0], pos[1] + 1))
-            possible_dirs.append(3)
-        return possible_nears, possible_dirs
@@ -0,0 +1,114 @@
+import numpy as np
+
+
+def _coords(positions):
+    # (n, 2) int32 array of (y, x) of a list of {'x', 'y'}, filled column by column
+    coords = np.empty((len(positions), 2), dtype=np.int32)
+    coords[:, 0] = [pos['y'] for pos in positions]
+    coords[:, 1] = [pos['x'] for pos in positions]
+    return coords
+
+
+def _yx(pos):
+    return (pos['y'], pos['x'])
+
+
+class Snake(object):
+    """
+    One snake of the request.
+
+    :param snake_id: ID of the snake
+    :type snake_id: str
+    :param index: Position of the snake in board.snakes, -1 if it is not on the board
+    :type index: int
+    :param health: Health of the snake
+    :type health: int
+    :param length: Length of the snake
+    :type length: int
+    :param body: (length, 2) int32 array of (y, x), head first
+    :type body: numpy.ndarray
+    :param head: (y, x) of the head
+    :type head: tuple
+    :param tail: (y, x) of the tail
+    :type tail: tuple
+    """
+    __slots__ = ('id', 'index', 'health', 'length', 'body', 'head', 'tail')
+
+    def __init__(self, snake_id, index, health, length, body, head, tail):
+        self.id = snake_id
+        self.index = index
+        self.health = health
+        self.length = length
+        self.body = body
+        # Plain ints, read far more often than the body
+        self.head = head
+        self.tail = tail
+
+
+class GameState(object):
+    """
+    Compact model of a move request, built once per request.
+
+    Every body of board.snakes lives in one int32 array of (y, x), each snake
+    body is a view of its rows, so building the state allocates a handful of
+    arrays whatever the number of snakes.
+    """
+    __slots__ = ('game_id', 'turn', 'timeout', 'w', 'h', 'food', 'bodies', 'snakes', 'index', 'you')
+
+    def __init__(self, game_id, turn, timeout, w, h, food, bodies, snakes, you):
+        self.game_id = game_id
+        self.turn = turn
+        self.timeout = timeout
+        self.w = w
+        self.h = h
+        self.food = food # (n, 2) int32 array of (y, x)
+        self.bodies = bodies # (n, 2) int32 array of (y, x) of every body of board.snakes
+        self.snakes = snakes # snakes of board.snakes, in order
+        self.index = {snake.id: snake.index for snake in snakes}
+        self.you = you
+
+    @classmethod
+    def from_data(cls, data):
+        board = data['board']
+        game = data['game']
+        raw_snakes = board['snakes'] if 'snakes' in board else []
+
+        bodies = _coords([pos for snake in raw_snakes for pos in snake['body']])
+        snakes = []
+        start = 0
+        for i, snake in enumerate(raw_snakes):
+            body = snake['body']
+            end = start + len(body)
+            snakes.append(Snake(snake['id'], i, snake['health'], snake.get('length', end - start), bodies[start:end], _yx(body[0]), _yx(body[-1])))
+            start = end
+
+        food = _coords(board['food'] if 'food' in board else [])
+
+        you = data['you']
+        body = you['body']
+        index = -1
+        for snake in snakes:
+            if snake.id == you['id']:
+                index = snake.index
+        you = Snake(you['id'], index, you['health'], you.get('length', len(body)), _coords(body), _yx(body[0]), _yx(body[-1]))
+
+        return cls(game['id'], data['turn'], game.get('timeout', 500), board['width'], board['height'], food, bodies, snakes, you)
+
+    def cell(self, y, x):
+        # Linear index of the cell
+        return y * self.w + x
+
+    def is_inside(self, y, x):
+        return 0 <= y < self.h and 0 <= x < self.w
+
+    def others(self):
+        # Snakes of the board except mine
+        return [snake for snake in self.snakes if snake.id != self.you.id]
+
+    def is_dead(self):
+        # My snake is no longer on the board
+        return self.you.id not in self.index
+
+    def unique_id(self):
+        # Same as util.unique_id
+        return f"{self.game_id}:{self.you.id}"
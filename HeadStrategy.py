@@ -10,32 +10,23 @@ class HeadStrategy(object):
         self.small_area_threshold = 11
         self.headLogic = hl.HeadLogic()
 
-    def start(self, data):
+    def start(self, data, session):
         pass
 
-    def end(self, data):
+    def end(self, data, session):
         pass
 
-    def move(self, data):
-        # 0 = empty
-        # 1 = barrier
-        # 2 = food
-        # 3 = head
-        board = data['board']
-        h = board['height']
-        w = board['width']
-        you = data['you']
-        head = you['head']
-
-        states = data['states']
-        block_arr = data['block_arr']
-        routes = data['routes']
+    def move(self, data, ctx):
+        # Routes are computed lazily, only the chosen direction is searched
+        block_arr = ctx.block_arr
+        routes = ctx.routes
 
         # Choose a random direction to move in
         possible_moves = ["up", "down", "left", "right"]
 
         # head move logic
-        ideal_move = self.headLogic.head_move(data, block_arr, routes)
+        with ctx.timed('head_move'):
+            ideal_move = self.headLogic.head_move(ctx.game, block_arr, routes, ctx.fields)
         if ideal_move is not None:
             return possible_moves[ideal_move]
 
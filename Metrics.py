@@ -0,0 +1,94 @@
+import bisect
+import threading
+
+# Upper bounds of the latency buckets in seconds, +Inf is implicit
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram(object):
+    """
+    Fixed bucket histogram of one label set.
+
+    :param buckets: Sorted upper bounds of the buckets
+    :type buckets: tuple
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        # (upper bound, observations <= upper bound) of every bucket, as Prometheus reports them
+        total = 0
+        bounds = [str(b) for b in self.buckets] + ["+Inf"]
+        for bound, n in zip(bounds, self.counts):
+            total += n
+            yield bound, total
+
+
+class Metrics(object):
+    """
+    Per-stage latency histograms labelled by stage, board size and mode.
+
+    Request threads only observe the timings of a turn once it is decided,
+    under one lock. The histograms are rendered in the Prometheus text format.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = {} # (stage, board, mode) -> Histogram
+        self.gauges = {} # name -> (help, callable)
+
+    def observe(self, timings, board, mode):
+        """
+        Observe the stage timings of one request
+
+        :param timings: Seconds spent in every stage
+        :type timings: dict
+        :param board: Board size label, e.g. "11x11"
+        :type board: str
+        :param mode: The mode which decided the move
+        :type mode: str
+        """
+        with self.lock:
+            for stage, seconds in timings.items():
+                key = (stage, board, mode)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(self.buckets)
+                histogram.observe(seconds)
+
+    def gauge(self, name, help_text, fn):
+        # Value read from fn when rendering
+        self.gauges[name] = (help_text, fn)
+
+    def render(self):
+        with self.lock:
+            snapshot = [(key, list(h.cumulative()), h.sum, h.count) for key, h in sorted(self.histograms.items())]
+
+        lines = [
+            "# HELP battlesnake_stage_seconds Time spent in each stage of a request.",
+            "# TYPE battlesnake_stage_seconds histogram",
+        ]
+        for (stage, board, mode), buckets, total, count in snapshot:
+            labels = 'stage="{}",board="{}",mode="{}"'.format(stage, board, mode)
+            for bound, n in buckets:
+                lines.append('battlesnake_stage_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, n))
+            lines.append('battlesnake_stage_seconds_sum{{{}}} {}'.format(labels, repr(total)))
+            lines.append('battlesnake_stage_seconds_count{{{}}} {}'.format(labels, count))
+        return "\n".join(lines) + "\n" + self.render_gauges()
+
+    def render_gauges(self):
+        # Only the gauges, for a process without histograms
+        lines = []
+        for name, (help_text, fn) in sorted(self.gauges.items()):
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} gauge".format(name))
+            lines.append("{} {}".format(name, fn()))
+        return "".join(line + "\n" for line in lines)
@@ -1,10 +1,15 @@
+import itertools
 import json
+import threading
 
 import random as rand
 
 import numpy as np
 
-from QTable import QTableMap as QTable
+import eventlog
+from QTable import QTableDense as QTable
+from QTable import QTableBinary, BINARY_EXTENSION
+from ReplayBuffer import ReplayBuffer
 
 
 class QLearner(object):
@@ -25,7 +30,15 @@ class QLearner(object):
     :type radr: float
     :param dyna: The number of dyna updates for each regular update. When Dyna is used, 200 is a typical value.
     :type dyna: int
-    :param verbose: If “verbose” is True, your code can print out information for debugging.
+    :param dyna_mode: 'batch' applies the dyna updates of a step as one vectorized update from the same Q table, 'sequential' applies them one by one.
+    :type dyna_mode: str
+    :param replay_capacity: The maximum number of experiences remembered for Dyna-Q.
+    :type replay_capacity: int
+    :param replay_eviction: How experiences are evicted once the replay buffer is full, 'fifo' or 'reservoir'.
+    :type replay_eviction: str
+    :param lock_stripes: The number of locks guarding the Q table, updates of states on different locks run concurrently.
+    :type lock_stripes: int
+    :param verbose: If “verbose” is True, every query is logged for debugging.
     :type verbose: bool
     """
     def __init__(
@@ -37,6 +50,10 @@ class QLearner(object):
         rar=0.5,
         radr=0.99,
         dyna=0,
+        dyna_mode='batch',
+        replay_capacity=100000,
+        replay_eviction='fifo',
+        lock_stripes=64,
         verbose=False,
     ):
         """
@@ -49,38 +66,46 @@ class QLearner(object):
         self.gamma = gamma
         self.rar = rar
         self.radr = radr
+        # rar is derived from a shared step counter so concurrent decays are never lost
+        self.initial_rar = rar
+        self.steps = itertools.count(1)
         self.dyna = dyna
-        self.s = {}
-        self.a = {}
+        if dyna_mode not in ('batch', 'sequential'):
+            raise ValueError("Unknown dyna mode {}, expected 'batch' or 'sequential'".format(dyna_mode))
+        self.dyna_mode = dyna_mode
         self.Q = QTable(num_states, num_actions)
-        # Dyna-Q parameters
-        self.exp_s = []
-        self.exp_a = []
-        self.exp_s_prime = []
-        self.exp_r = []
-
-    # Start a new game with game ID to support concurrency
-    def start(self, game_id):
-        self.s[game_id] = 0
-        self.a[game_id] = 0
-        print("Start a new game: {}".format(game_id))
-
-    # Clean up remember state to support concurrency and save memory
-    def end(self, game_id):
-        self.s.pop(game_id, None)
-        self.a.pop(game_id, None)
-        print("End a game: {}".format(game_id))
-
-    def load(self, fname):
-        # Load Q table
-        self.Q.load(fname)
-        print("Loading QTable from {}".format(fname))
+        # Every update of a state happens under the lock of its stripe
+        self.locks = [threading.Lock() for _ in range(lock_stripes)]
+        # Optional QTableStore journaling every update
+        self.journal = None
+        # Optional QTableShared.QTableUpdates, the experiences are learned by the process owning the Q table
+        self.remote = None
+        # Dyna-Q experiences
+        self.exp = ReplayBuffer(replay_capacity, replay_eviction)
+
+    # Start a new game, the state of every game lives in its session to support concurrency
+    def start(self, session):
+        session.s = 0
+        session.a = 0
+        eventlog.debug("learner_start", game=session.id)
+
+    def end(self, session):
+        eventlog.debug("learner_end", game=session.id)
+
+    def load(self, fname, writable=False):
+        # Load Q table, binary tables are memory mapped (copy-on-write if writable)
+        if fname.endswith(BINARY_EXTENSION):
+            self.Q = QTableBinary(self.num_states, self.num_actions)
+            self.Q.load(fname, writable=writable)
+        else:
+            self.Q.load(fname)
+        eventlog.info("qtable_load", path=fname)
 
     def dump(self, fname):
         # dump Q table as json string
         return self.Q.dump(fname)
 
-    def querysetstate(self, s, block_arr, game_id):
+    def querysetstate(self, s, block_arr, session):
         """
         Update the state without updating the Q-table
 
@@ -88,21 +113,21 @@ class QLearner(object):
         :type s: int
         :param block_arr: Array of boolean indicates if there is an immediate block at earch direction. ["up", "down", "left", "right"]
         :type block_arr: array(boolean)
-        :param game_id: The Game ID for retireve corresponding memory state
-        :type game_id: str
+        :param session: The session of the game, holds the previous state and action
+        :type session: SessionStore.Session
         :return: The selected action
         :rtype: int
         """
         # This function usaully used for setting initial state and action
         action = self.__choose_next_action(s, block_arr, decay=False)
         if self.verbose:
-            print(f"s = {s}, a = {action}")
+            eventlog.info("learner_query", game=session.id, s=s, a=int(action))
         # Saved the new state
-        self.s[game_id] = s
-        self.a[game_id] = action
+        session.s = s
+        session.a = action
         return action
 
-    def query(self, s_prime, r, block_arr, game_id):
+    def query(self, s_prime, r, block_arr, session):
         """
         Update the Q table and return an action
 
@@ -112,37 +137,52 @@ class QLearner(object):
         :type r: float
         :param block_arr: Array of boolean indicates if there is an immediate block at earch direction. ["up", "down", "left", "right"]
         :type block_arr: array(boolean)
-        :param game_id: The Game ID for retireve corresponding memory state
-        :type game_id: str
+        :param session: The session of the game, holds the previous state and action
+        :type session: SessionStore.Session
         :return: The selected action
         :rtype: int
         """
 
         # First, update the Q table and get a_prime
-        self.__update_Q_table(self.s[game_id], self.a[game_id], s_prime, r)
-        self.__update_exp(self.s[game_id], self.a[game_id], s_prime, r)
-
-        # Run Dyna to bosst learning if needed
-        if self.dyna > 0:
-            self.__run_dyna(self.s[game_id], self.a[game_id], s_prime, r)
+        if self.remote is not None:
+            self.remote.put(session.s, session.a, s_prime, r)
+        else:
+            self.learn(session.s, session.a, s_prime, r)
 
         # Choose next action and decaly the probability
         action = self.__choose_next_action(s_prime, block_arr, decay=True)
 
         if self.verbose:
-            print(f"s = {s_prime}, a = {action}, r={r}")
+            eventlog.info("learner_query", game=session.id, s=s_prime, a=int(action), r=r)
 
         # Saved the new state
-        self.s[game_id] = s_prime
-        self.a[game_id] = action
+        session.s = s_prime
+        session.a = action
         return action
 
+    def learn(self, s, a, s_prime, r):
+        """
+        Update the Q table from one experience, with the Dyna updates
+
+        :param s: The previous state
+        :type s: int
+        :param a: The action taken in the previous state
+        :type a: int
+        :param s_prime: The new state
+        :type s_prime: int
+        :param r: The immediate reward
+        :type r: float
+        """
+        self.__update_Q_table(s, a, s_prime, r)
+        self.__update_exp(s, a, s_prime, r)
+
+        # Run Dyna to bosst learning if needed
+        if self.dyna > 0:
+            self.__run_dyna(s, a, s_prime, r)
+
     def __update_exp(self, s, a, s_prime, r):
         # Memorize (s, a) for Dyna-Q
-        self.exp_s.append(s)
-        self.exp_a.append(a)
-        self.exp_s_prime.append(s_prime)
-        self.exp_r.append(r)
+        self.exp.add(s, a, s_prime, r)
 
     def __update_Q_table(self, s, a, s_prime, r):
         """
@@ -151,8 +191,34 @@ class QLearner(object):
         # Fist component is update from past experience
         # Second component is update from imporved estimate from new state
         # which is immediate reward + discounted rate * future reward
-        new_val = (1 - self.alpha) * self.Q.get(s, a) + self.alpha * (r + self.gamma * self.Q.get(s_prime, np.argmax(self.Q.get(s_prime))))
-        self.Q.update(s, a, new_val)
+        with self.locks[int(s) % len(self.locks)]:
+            if hasattr(self.Q, 'td_update'):
+                # Computed and written in place by the table
+                new_val = self.Q.td_update(s, a, s_prime, r, self.alpha, self.gamma)
+            else:
+                new_val = (1 - self.alpha) * self.Q.get(s, a) + self.alpha * (r + self.gamma * self.Q.get(s_prime, np.argmax(self.Q.get(s_prime))))
+                self.Q.update(s, a, new_val)
+            # Journaled under the lock, so the journal keeps the order of the updates of a state
+            if self.journal is not None:
+                self.journal.append(s, a, new_val)
+
+    def __update_Q_table_batch(self, s, a, s_prime, r):
+        """
+        Update the Q table with the same formula for a batch of experiences.
+        Every target is computed from the table before the batch, and the last
+        write wins when a (s, a) is repeated. The batch is split by lock stripe,
+        each part is updated under its own lock.
+        """
+        stripes = s % len(self.locks)
+        for stripe in np.unique(stripes):
+            i = np.flatnonzero(stripes == stripe)
+            with self.locks[stripe]:
+                q = self.Q.get_rows(s[i])[np.arange(len(i)), a[i]]
+                future = self.Q.get_rows(s_prime[i]).max(axis=1)
+                new_vals = (1 - self.alpha) * q + self.alpha * (r[i] + self.gamma * future)
+                self.Q.update_batch(s[i], a[i], new_vals)
+                if self.journal is not None:
+                    self.journal.append_batch(s[i], a[i], new_vals)
 
     def __choose_next_action(self, s_prime, block_arr, decay=False):
         # Random select an action or find the optimal one
@@ -166,13 +232,13 @@ class QLearner(object):
             action = rand.choice(available_actions)
             # print(f"USE RANDOM: ({s_prime})")
         else:
-            constraint_arr = np.array(self.Q.get(s_prime))
-            constraint_arr[block_arr] = float('-inf')
+            # One new array, the row itself may be read-only or shared
+            constraint_arr = np.where(block_arr, float('-inf'), self.Q.get(s_prime))
             action = np.argmax(constraint_arr)
             # print(f"USE QTable: ({constraint_arr})")
         # Decay the random probability
         if decay:
-            self.rar *= self.radr
+            self.rar = self.initial_rar * self.radr ** next(self.steps)
         return action
 
     def __run_dyna(self, s, a, s_prime, r):
@@ -184,13 +250,12 @@ class QLearner(object):
 
         # Halucinate experience and update Q table
         # We should random select the (s, a) combination we seen before
-        rand_i = np.random.randint(0, len(self.exp_s), size=self.dyna)
-        for i in rand_i:
-            new_s = self.exp_s[i]
-            new_a = self.exp_a[i]
-            new_s_prime = self.exp_s_prime[i]
-            new_r = self.exp_r[i]
-            self.__update_Q_table(int(new_s), int(new_a), int(new_s_prime), new_r)
+        exp_s, exp_a, exp_s_prime, exp_r = self.exp.sample(self.dyna)
+        if self.dyna_mode == 'batch':
+            self.__update_Q_table_batch(exp_s, exp_a, exp_s_prime, exp_r)
+            return
+        for i in range(self.dyna):
+            self.__update_Q_table(int(exp_s[i]), int(exp_a[i]), int(exp_s_prime[i]), exp_r[i])
 
 
 if __name__ == "__main__":
@@ -5,24 +5,32 @@ import cherrypy
 import util
 
 import config as cf
+import eventlog
 import QLearner as ql
+from QTableStore import QTableStore
+from TurnContext import TurnContext
 
 class RememberState(object):
-    def __init__(self, data):
-        self.health = data['you']['health']
-        self.length = data['you']['length']
+    def __init__(self, health, length):
+        self.health = health
+        self.length = length
 
 
 class QLearnerStrategy(object):
-    def __init__(self, raw_config):
-        # Runtime default settings
-        self.health_threshold = {}
-        self.prev_state = {}
-
+    """
+    :param raw_config: The content of learner.json
+    :type raw_config: dict
+    :param table: Q table shared with other processes, used instead of a table of this process
+    :type table: QTableShared.QTableShared
+    :param updates: Where the experiences go when another process owns the shared table, None in the owner
+    :type updates: QTableShared.QTableUpdates
+    """
+    def __init__(self, raw_config, table=None, updates=None):
         # Load learner parameters from learner.json
         self.config = cf.LearnerConfig(raw_config)
         self.runtime_config = cf.RuntimeConfig(raw_config)
         self.reward_config = cf.RewardConfig(raw_config)
+        self.persistence_config = cf.PersistenceConfig(raw_config)
         self.is_learning_mode = self.runtime_config.is_learning_mode
 
         # Initialize the QLearner
@@ -34,84 +42,156 @@ class QLearnerStrategy(object):
             rar=self.config.rar,
             radr=self.config.radr,
             dyna=self.config.dyna,
+            dyna_mode=self.config.dyna_mode,
+            replay_capacity=self.config.replay_capacity,
+            replay_eviction=self.config.replay_eviction,
+            lock_stripes=self.config.lock_stripes,
             verbose=self.config.verbose,
         )
-        if self.config.Q:
-            if os.path.isfile(self.config.Q):
-                self.learner.load(self.config.Q)
-
-    def start(self, data):
+        if table is not None:
+            self.learner.Q = table
+
+        self.store = None
+        self.updates = updates
+        if updates is not None:
+            # Worker process, the owner of the shared table loads, learns and persists it
+            self.learner.remote = updates if self.is_learning_mode else None
+            return
+
+        # Learned updates are journaled and snapshotted in the background
+        q_path = self.config.Q
+        if self.is_learning_mode and (self.persistence_config.enabled or self.runtime_config.dump_at_end):
+            self.store = QTableStore(
+                self.persistence_config.snapshot,
+                self.persistence_config.journal,
+                self.config.num_actions,
+                util.encoder_id(),
+                interval=self.persistence_config.interval,
+                flush_interval=self.persistence_config.flush_interval,
+            )
+            # Replay the journal left by the previous run into the snapshot
+            self.store.recover()
+            q_path = self.persistence_config.snapshot
+
+        if q_path:
+            if os.path.isfile(q_path):
+                if table is not None and len(table) > 0:
+                    # A restarted writer, the live table is newer than the snapshot
+                    eventlog.info("qtable_live", path=q_path, rows=len(table))
+                elif table is not None:
+                    table.load(q_path)
+                    eventlog.info("qtable_load", path=q_path, rows=len(table))
+                else:
+                    self.learner.load(q_path, writable=self.is_learning_mode)
+                encoder = getattr(self.learner.Q, 'encoder', None)
+                if encoder is not None and encoder != util.encoder_id():
+                    eventlog.warning("encoder_mismatch", path=q_path, trained=encoder, running=util.encoder_id())
+
+        if self.store is not None:
+            self.learner.journal = self.store
+            self.store.start()
+
+    def start(self, data, session):
         # Start the game with initial setup
-        game_id = util.unique_id(data)
-        self.learner.start(game_id)
-        self.health_threshold[game_id] = self.runtime_config.health_threshold
+        self.learner.start(session)
+        session.health_threshold = self.runtime_config.health_threshold
 
-    def move(self, data):
+    def move(self, data, ctx):
 
         # Choose a random direction to move in
         possible_moves = ["up", "down", "left", "right"]
 
+        return possible_moves[self.__query(ctx)]
+
+    def skip(self, session):
+        # The deadline came before the learner, the turn is not learned and the next one starts
+        # over with querysetstate, so no update is credited to the action of an older turn
+        session.prev_state = None
+
+    def __query(self, ctx):
         # Construct states and query learner
-        game_id = util.unique_id(data)
-        if game_id not in self.prev_state:
-            state, block_arr = util.discretize(data, self.config.num_actions, self.health_threshold[game_id])
-            action = self.learner.querysetstate(state, block_arr, game_id)
+        session = ctx.session
+        if session.health_threshold is None:
+            # The start of the game was missed
+            session.health_threshold = self.runtime_config.health_threshold
+        if session.prev_state is None:
+            state, block_arr = ctx.discretize(session.health_threshold)
+            with ctx.timed('query'):
+                action = self.learner.querysetstate(state, block_arr, session)
         else:
             # Calculate reward based on previous state
-            r = self.__calc_reward(data, game_id)
+            r = self.__calc_reward(ctx.game, session)
 
-            state, block_arr = util.discretize(data, self.config.num_actions, self.health_threshold[game_id])
-            if self.is_learning_mode:
-                action = self.learner.query(state, r, block_arr, game_id)
-            else:
-                action = self.learner.querysetstate(state, block_arr, game_id)
-        move = possible_moves[action]
+            state, block_arr = ctx.discretize(session.health_threshold)
+            with ctx.timed('query'):
+                if self.is_learning_mode:
+                    action = self.learner.query(state, r, block_arr, session)
+                else:
+                    action = self.learner.querysetstate(state, block_arr, session)
 
         # Memorize previous state
-        self.prev_state[game_id] = RememberState(data)
+        session.prev_state = RememberState(ctx.game.you.health, ctx.game.you.length)
 
         # print(f"THIS TURN({data['turn']})")
         # print(f"THIS MOVE({game_id}): {move}")
         # print(f"THIS STATE({state})")
-        return move
-
-    def end(self, data):
-        game_id = util.unique_id(data)
-        # Punish or reward when game end in learning mode
-        if self.is_learning_mode and game_id in self.prev_state:
-            # Calculate reward based on previous state
-            r = self.__calc_reward(data, game_id, is_end=True)
-            state, block_arr = util.discretize(data, self.config.num_actions, self.health_threshold[game_id])
-            _ = self.learner.query(state, r, block_arr, game_id)
-            # print(self.learner.dump(self.config.Q))
-
-        # Clean up to save memory
-        self.prev_state.pop(game_id, None)
-        self.health_threshold.pop(game_id, None)
-        self.learner.end(game_id)
+        return action
+
+    def end(self, data, session):
+        # Nothing to learn from a game whose session was evicted or never started
+        if session is not None:
+            # Punish or reward when game end in learning mode
+            if self.is_learning_mode and session.prev_state is not None:
+                # Calculate reward based on previous state
+                ctx = TurnContext(data, self.config.num_actions, session)
+                r = self.__calc_reward(ctx.game, session, is_end=True)
+                state, block_arr = ctx.discretize(session.health_threshold)
+                _ = self.learner.query(state, r, block_arr, session)
+                # print(self.learner.dump(self.config.Q))
+            self.learner.end(session)
 
         if self.runtime_config.dump_at_end:
-            self.dump()
+            # Written by the store thread, never on the request thread
+            if self.store is not None:
+                self.store.request_snapshot()
+            elif self.updates is not None and self.is_learning_mode:
+                self.updates.request_snapshot()
+
+    def checkpoint(self, session):
+        # Per-game state of the learner, enough for another process to continue the game
+        prev = session.prev_state
+        return [int(session.s), int(session.a), session.health_threshold,
+                None if prev is None else [prev.health, prev.length]]
+
+    def restore(self, session, checkpoint):
+        # Continue the game from a checkpoint
+        session.s, session.a, session.health_threshold, prev = checkpoint
+        session.prev_state = None if prev is None else RememberState(*prev)
+
+    def stop(self):
+        # Write the last snapshot when the server stops
+        if self.store is not None:
+            self.store.stop()
 
     def dump(self):
         # This function is called when you want to dump the Q tablel to file
-        print(self.learner.dump(self.config.Q))
+        eventlog.info("qtable_dump", result=self.learner.dump(self.config.Q))
         return "ok"
 
-    def __calc_reward(self, data, game_id, is_end=False):
-        curr_s = RememberState(data)
-        prev_s = self.prev_state[game_id]
+    def __calc_reward(self, game, session, is_end=False):
+        curr_s = RememberState(game.you.health, game.you.length)
+        prev_s = session.prev_state
         r = self.reward_config.default
 
         # Starving to die
-        if curr_s.health == 0 or (is_end and util.is_die(data)):
-            print("!!!!I'm die!!!!")
+        if curr_s.health == 0 or (is_end and game.is_dead()):
+            eventlog.info("die", game=session.id, turn=game.turn)
             r = self.reward_config.die
         elif curr_s.health >= prev_s.health:
             r = self.reward_config.eat_food
             # After eating food, decay the health threshold
             health_t_decay = self.runtime_config.health_threshold_decay
-            self.health_threshold[game_id] *= health_t_decay
-        elif prev_s.health <= self.health_threshold[game_id]:
+            session.health_threshold *= health_t_decay
+        elif prev_s.health <= session.health_threshold:
             r = self.reward_config.low_health
         return r
\ No newline at end of file
@@ -1,7 +1,21 @@
+import argparse
 import json
+import struct
+import sys
+import threading
 
 import numpy as np
 
+# Binary table format:
+#   magic (4 bytes) | header length (uint32) | JSON header | keys | values
+# The keys are a sorted int64 state index and the values a (rows, num_actions)
+# matrix, both starting at a 64 bytes aligned offset recorded in the header so
+# they can be memory mapped without reading the file.
+BINARY_MAGIC = b'QTBL'
+BINARY_VERSION = 1
+BINARY_EXTENSION = '.qtb'
+_ALIGN = 64
+
 
 class NumpyEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -45,6 +59,15 @@ class QTableMap(object):
             self.Q[state] = np.ones(self.num_actions) * -1.0
         self.Q[state][action] = val
 
+    def get_rows(self, states):
+        # (len(states), num_actions) array of the rows of the states
+        return np.array([self.get(state) for state in states], dtype=float).reshape(len(states), self.num_actions)
+
+    def update_batch(self, states, actions, vals):
+        # Last write wins for repeated (state, action)
+        for state, action, val in zip(states.tolist(), actions.tolist(), vals.tolist()):
+            self.update(state, action, val)
+
     def load(self, fname):
         with open(fname) as f:
             data = json.load(f)
@@ -80,6 +103,12 @@ class QTableArray(object):
     def update(self, state, action, val):
         self.Q[state, action] = val
 
+    def get_rows(self, states):
+        return self.Q[states]
+
+    def update_batch(self, states, actions, vals):
+        self.Q[states, actions] = vals
+
     def load(self, fname):
         with open(fname) as f:
             data = json.load(f)
@@ -89,3 +118,364 @@ class QTableArray(object):
         with open(fname, 'w') as f:
             json.dump(self.Q, f, cls=NumpyEncoder)
         return "Writing QTable into {}".format(fname)
+
+
+
+def _aligned(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def write_binary(fname, keys, values, encoder, dtype='<f8'):
+    """
+    Write a binary table
+
+    :param keys: State keys, sorted by write_binary
+    :type keys: array(int)
+    :param values: One row of action values per key
+    :type values: array(float)
+    :param encoder: ID of the state encoder the table was trained with
+    :type encoder: str
+    """
+    keys = np.asarray(keys, dtype='<i8')
+    values = np.asarray(values, dtype=dtype).reshape(len(keys), -1)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    values = values[order]
+
+    header = {
+        'version': BINARY_VERSION,
+        'num_actions': int(values.shape[1]),
+        'rows': int(len(keys)),
+        'encoder': encoder,
+        'dtype': np.dtype(dtype).str,
+    }
+    # The offsets depend on the header length, so size the header with them first
+    header['keys_offset'] = 0
+    header['values_offset'] = 0
+    prefix = len(BINARY_MAGIC) + 4
+    header_len = len(json.dumps(header)) + 32
+    header['keys_offset'] = _aligned(prefix + header_len)
+    header['values_offset'] = _aligned(header['keys_offset'] + keys.nbytes)
+    raw = json.dumps(header).encode().ljust(header_len)
+
+    with open(fname, 'wb') as f:
+        f.write(BINARY_MAGIC)
+        f.write(struct.pack('<I', len(raw)))
+        f.write(raw)
+        f.write(b'\0' * (header['keys_offset'] - f.tell()))
+        f.write(keys.tobytes())
+        f.write(b'\0' * (header['values_offset'] - f.tell()))
+        f.write(values.tobytes())
+    return header
+
+
+def read_binary_header(fname):
+    with open(fname, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError("{} is not a binary QTable".format(fname))
+        (header_len,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_len).decode())
+    if header['version'] > BINARY_VERSION:
+        raise ValueError("{} has unsupported QTable version {}".format(fname, header['version']))
+    return header
+
+
+def map_binary(fname, mode='r'):
+    """
+    Memory map a binary table
+
+    :param mode: 'r' for read only, 'c' for copy-on-write
+    :type mode: str
+    :return: (header, keys, values)
+    :rtype: tuple
+    """
+    header = read_binary_header(fname)
+    rows = header['rows']
+    if rows == 0:
+        keys = np.zeros(0, dtype='<i8')
+        values = np.zeros((0, header['num_actions']), dtype=header['dtype'])
+        return header, keys, values
+    keys = np.memmap(fname, dtype='<i8', mode=mode, offset=header['keys_offset'], shape=(rows,))
+    values = np.memmap(fname, dtype=header['dtype'], mode=mode, offset=header['values_offset'], shape=(rows, header['num_actions']))
+    return header, keys, values
+
+
+def json_to_binary(src, dst, num_actions, encoder, dtype='<f8'):
+    with open(src) as f:
+        table = json.load(f)
+    keys = np.array([int(state) for state in table.keys()], dtype='<i8')
+    values = np.array([table[state] for state in table.keys()], dtype=dtype).reshape(len(keys), num_actions)
+    return write_binary(dst, keys, values, encoder, dtype)
+
+
+def binary_to_json(src, dst):
+    header, keys, values = map_binary(src)
+    table = {str(int(k)): values[i].tolist() for i, k in enumerate(keys)}
+    with open(dst, 'w') as f:
+        json.dump(table, f)
+    return header
+
+
+class QTableBinary(object):
+    """
+    This is a memory mapped Q learner table.
+
+    Rows of the loaded file are looked up with a binary search of the sorted
+    key index. In copy-on-write mode updated rows stay private to the process
+    and states missing from the file are kept in a map.
+    """
+    def __init__(
+        self,
+        num_states,
+        num_actions,
+        encoder=None
+    ):
+        """
+        Constructor method
+        """
+        self.num_actions = num_actions
+        self.encoder = encoder
+        self.header = None
+        self.keys = np.zeros(0, dtype='<i8')
+        self.values = np.zeros((0, num_actions))
+        self.Q = {} # rows of states missing from the file
+
+    def __index(self, state):
+        i = int(np.searchsorted(self.keys, state))
+        if i < len(self.keys) and self.keys[i] == state:
+            return i
+        return -1
+
+    def __batch_index(self, states):
+        # Row of every state in the file and whether it was found, one vectorized search
+        if len(self.keys) == 0:
+            return np.zeros(len(states), dtype=np.int64), np.zeros(len(states), dtype=bool)
+        i = np.minimum(np.searchsorted(self.keys, states), len(self.keys) - 1)
+        return i, self.keys[i] == states
+
+    def get(self, state, action=None):
+        state = int(state)
+        i = self.__index(state)
+        if i >= 0:
+            row = self.values[i]
+        elif state in self.Q:
+            row = self.Q[state]
+        else:
+            if action is not None:
+                return -1.0
+            else:
+                return np.ones(self.num_actions) * -1.0
+        if action is not None:
+            return row[action]
+        return row
+
+    def update(self, state, action, val):
+        state = int(state)
+        i = self.__index(state)
+        if i >= 0:
+            self.values[i, action] = val
+            return
+        if state not in self.Q:
+            self.Q[state] = np.ones(self.num_actions) * -1.0
+        self.Q[state][action] = val
+
+    def get_rows(self, states):
+        states = np.asarray(states, dtype='<i8')
+        rows = np.ones((len(states), self.num_actions)) * -1.0
+        i, found = self.__batch_index(states)
+        rows[found] = self.values[i[found]]
+        for j in np.flatnonzero(~found):
+            state = int(states[j])
+            if state in self.Q:
+                rows[j] = self.Q[state]
+        return rows
+
+    def update_batch(self, states, actions, vals):
+        states = np.asarray(states, dtype='<i8')
+        i, found = self.__batch_index(states)
+        self.values[i[found], actions[found]] = vals[found]
+        for j in np.flatnonzero(~found):
+            self.update(int(states[j]), int(actions[j]), vals[j])
+
+    def load(self, fname, writable=False):
+        # Copy-on-write keeps learning updates away from the file
+        self.header, self.keys, self.values = map_binary(fname, mode='c' if writable else 'r')
+        if self.header['num_actions'] != self.num_actions:
+            raise ValueError("{} has {} actions, expected {}".format(fname, self.header['num_actions'], self.num_actions))
+        if self.encoder is None:
+            self.encoder = self.header['encoder']
+        self.Q = {}
+
+    def dump(self, fname='qtable.qtb'):
+        extra = sorted(self.Q.keys())
+        keys = np.concatenate([np.asarray(self.keys), np.array(extra, dtype='<i8')])
+        values = np.concatenate([np.asarray(self.values, dtype=float), np.array([self.Q[s] for s in extra]).reshape(-1, self.num_actions)])
+        if fname.endswith(BINARY_EXTENSION):
+            write_binary(fname, keys, values, self.encoder)
+        else:
+            with open(fname, 'w') as f:
+                json.dump({str(int(k)): values[i].tolist() for i, k in enumerate(keys)}, f)
+        return "Writing QTable into {}".format(fname)
+
+
+class QTableDense(object):
+    """
+    This is an integer keyed Q learner table in fixed size blocks of rows.
+
+    States map to the rows of float arrays of capacity rows, a new block is
+    added when the last one is full, so rows never move. Missing states read
+    a shared read-only row of -1.0, so queries never allocate, and the TD
+    update is computed and written in place. Only inserting a state takes the
+    lock of the table, writes to a row happen under the lock of the caller,
+    the stripe lock of the state in QLearner, and reads take no lock.
+
+    :param capacity: The number of rows of a block, rounded up to a power of two
+    :type capacity: int
+    """
+    def __init__(
+        self,
+        num_states,
+        num_actions,
+        capacity=1024
+    ):
+        """
+        Constructor method
+        """
+        self.num_actions = num_actions
+        self.encoder = None
+        self.index = {}
+        self.shift = max(int(capacity) - 1, 1).bit_length()
+        self.mask = (1 << self.shift) - 1
+        self.blocks = []
+        self.default = np.ones(num_actions) * -1.0
+        self.default.flags.writeable = False
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __insert(self, state):
+        # Row of the state, a new row of -1.0 if missing
+        i = self.index.get(state)
+        if i is None:
+            with self.lock:
+                i = self.index.get(state)
+                if i is None:
+                    i = len(self.index)
+                    if i >> self.shift == len(self.blocks):
+                        self.blocks.append(np.empty((self.mask + 1, self.num_actions)))
+                    self.blocks[i >> self.shift][i & self.mask] = -1.0
+                    # Published after its values
+                    self.index[int(state)] = i
+        return i
+
+    def get(self, state, action=None):
+        i = self.index.get(state)
+        if i is None:
+            if action is not None:
+                return -1.0
+            else:
+                return self.default
+        row = self.blocks[i >> self.shift][i & self.mask]
+        if action is not None:
+            return row[action]
+        return row
+
+    def update(self, state, action, val):
+        i = self.__insert(state)
+        self.blocks[i >> self.shift][i & self.mask, action] = val
+
+    def td_update(self, state, action, state_prime, r, alpha, gamma):
+        """
+        Q(s, a) = (1 - alpha) * Q(s, a) + alpha * (r + gamma * max(Q(s', .))), in place
+
+        :return: The new Q(s, a)
+        :rtype: float
+        """
+        i = self.__insert(state)
+        row = self.blocks[i >> self.shift][i & self.mask]
+        j = self.index.get(state_prime)
+        future = self.blocks[j >> self.shift][j & self.mask].max() if j is not None else -1.0
+        new_val = (1 - alpha) * row[action] + alpha * (r + gamma * future)
+        row[action] = new_val
+        return new_val
+
+    def get_rows(self, states):
+        rows = np.ones((len(states), self.num_actions)) * -1.0
+        index = self.index
+        blocks = self.blocks
+        for j, state in enumerate(np.asarray(states).tolist()):
+            i = index.get(state)
+            if i is not None:
+                rows[j] = blocks[i >> self.shift][i & self.mask]
+        return rows
+
+    def update_batch(self, states, actions, vals):
+        # Last write wins for repeated (state, action)
+        for state, action, val in zip(np.asarray(states).tolist(), np.asarray(actions).tolist(), np.asarray(vals).tolist()):
+            self.update(state, action, val)
+
+    def nbytes(self):
+        # The blocks, the index and its int keys and rows
+        with self.lock:
+            return (sum(block.nbytes for block in self.blocks) + sys.getsizeof(self.index)
+                    + sum(sys.getsizeof(state) + sys.getsizeof(i) for state, i in self.index.items()))
+
+    def load(self, fname):
+        # JSON or binary table, replacing the rows
+        if fname.endswith(BINARY_EXTENSION):
+            self.encoder = read_binary_header(fname)['encoder']
+            _, keys, values = map_binary(fname)
+            keys = np.asarray(keys).tolist()
+        else:
+            with open(fname) as f:
+                data = json.load(f)
+            keys = [int(state) for state in data.keys()]
+            values = list(data.values())
+        values = np.array(values, dtype=float).reshape(len(keys), self.num_actions)
+        size = self.mask + 1
+        blocks = []
+        for start in range(0, len(keys), size):
+            block = np.empty((size, self.num_actions))
+            block[:len(values) - start] = values[start:start + size]
+            blocks.append(block)
+        with self.lock:
+            self.index = {state: i for i, state in enumerate(keys)}
+            self.blocks = blocks
+
+    def dump(self, fname='qtable.json'):
+        # Rows are numbered in the insertion order of the index
+        with self.lock:
+            keys = list(self.index.keys())
+            blocks = list(self.blocks)
+        values = np.concatenate(blocks)[:len(keys)] if blocks else np.empty((0, self.num_actions))
+        if fname.endswith(BINARY_EXTENSION):
+            write_binary(fname, keys, values, self.encoder)
+        else:
+            with open(fname, 'w') as f:
+                json.dump({str(state): values[i].tolist() for i, state in enumerate(keys)}, f)
+        return "Writing QTable into {}".format(fname)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert Q tables between the JSON and the binary format")
+    parser.add_argument("src")
+    parser.add_argument("dst")
+    parser.add_argument("--num-actions", type=int, default=4)
+    parser.add_argument("--encoder", default=None, help="state encoder ID, defaults to the one of util.discretize")
+    parser.add_argument("--dtype", default='<f8', choices=['<f4', '<f8'])
+    args = parser.parse_args()
+
+    if args.src.endswith(BINARY_EXTENSION):
+        header = binary_to_json(args.src, args.dst)
+    else:
+        encoder = args.encoder
+        if encoder is None:
+            import util
+            encoder = util.encoder_id()
+        header = json_to_binary(args.src, args.dst, args.num_actions, encoder, args.dtype)
+    print("Converted {} rows of {} actions ({}) into {}".format(header['rows'], header['num_actions'], header['encoder'], args.dst))
+
+
+if __name__ == "__main__":
+    main()
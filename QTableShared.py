@@ -0,0 +1,183 @@
+import queue
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from QTable import BINARY_EXTENSION, read_binary_header
+from QTableStore import read_table, write_table
+
+# Shared memory layout:
+#   header (int64 x 8) | keys (int64 x capacity) | values (float64 x capacity x num_actions)
+# Open addressing with linear probing over a power of two capacity. Rows are
+# never removed and EMPTY marks the free slots.
+EMPTY = -1
+_HEADER = 8
+_CAPACITY = 0
+_NUM_ACTIONS = 1
+_ROWS = 2
+# Inserts stop at this load, so a probe always ends on an empty slot
+MAX_LOAD = 0.75
+# Fibonacci hashing, spreads consecutive states over the table
+_GOLDEN = 0x9E3779B97F4A7C15
+_MASK64 = (1 << 64) - 1
+# Message asking the writer for a snapshot
+SNAPSHOT = "snapshot"
+
+
+class QTableShared(object):
+    """
+    This is a Q learner table in shared memory, read by every worker process
+    without copying.
+
+    One process writes the table, the others only read it. A new row is
+    filled before its key is published, so a reader which finds a key always
+    reads initialized values, and every value is an aligned 8 bytes store, so
+    a reader sees an action value either before or after an update.
+
+    :param capacity: The number of slots, rounded up to a power of two, twice num_states by default
+    :type capacity: int
+    :param name: Attach to the shared memory of this name instead of creating it
+    :type name: str
+    """
+    def __init__(
+        self,
+        num_states,
+        num_actions,
+        capacity=None,
+        name=None
+    ):
+        """
+        Constructor method
+        """
+        self.encoder = None
+        if name is None:
+            capacity = 1 << max(int(capacity or 2 * num_states) - 1, 1).bit_length()
+            size = 8 * (_HEADER + capacity + capacity * num_actions)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.header = np.ndarray((_HEADER,), dtype=np.int64, buffer=self.shm.buf)
+            self.header[:] = 0
+            self.header[_CAPACITY] = capacity
+            self.header[_NUM_ACTIONS] = num_actions
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.header = np.ndarray((_HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        self.name = self.shm.name
+        self.capacity = int(self.header[_CAPACITY])
+        self.num_actions = int(self.header[_NUM_ACTIONS])
+        self.mask = self.capacity - 1
+        self.shift = 64 - (self.capacity.bit_length() - 1)
+        self.limit = int(self.capacity * MAX_LOAD)
+
+        offset = 8 * _HEADER
+        self.keys = np.ndarray((self.capacity,), dtype=np.int64, buffer=self.shm.buf, offset=offset)
+        self.values = np.ndarray((self.capacity, self.num_actions), dtype=np.float64, buffer=self.shm.buf,
+                                 offset=offset + 8 * self.capacity)
+        if name is None:
+            self.keys[:] = EMPTY
+        # Probing through a memoryview is much faster than indexing the array from Python
+        self.slots = self.shm.buf[offset:offset + 8 * self.capacity].cast('q')
+
+    def __len__(self):
+        return int(self.header[_ROWS])
+
+    def nbytes(self):
+        return self.shm.size
+
+    def __slot(self, state):
+        # Slot of the state, or the empty slot ending its probe sequence
+        i = ((state * _GOLDEN) & _MASK64) >> self.shift
+        slots = self.slots
+        while True:
+            key = slots[i]
+            if key == state or key == EMPTY:
+                return i
+            i = (i + 1) & self.mask
+
+    def __insert(self, state):
+        # Slot of the state, a new row of -1.0 if missing
+        i = self.__slot(state)
+        if self.slots[i] == EMPTY:
+            if self.header[_ROWS] >= self.limit:
+                raise ValueError("The shared QTable is full with {} rows".format(int(self.header[_ROWS])))
+            self.values[i] = -1.0
+            # Published after its values
+            self.slots[i] = state
+            self.header[_ROWS] += 1
+        return i
+
+    def get(self, state, action=None):
+        i = self.__slot(int(state))
+        if self.slots[i] == EMPTY:
+            if action is not None:
+                return -1.0
+            else:
+                return np.ones(self.num_actions) * -1.0
+        if action is not None:
+            return self.values[i, action]
+        return self.values[i]
+
+    def update(self, state, action, val):
+        self.values[self.__insert(int(state)), action] = val
+
+    def get_rows(self, states):
+        rows = np.ones((len(states), self.num_actions)) * -1.0
+        for j, state in enumerate(np.asarray(states).tolist()):
+            i = self.__slot(state)
+            if self.slots[i] != EMPTY:
+                rows[j] = self.values[i]
+        return rows
+
+    def update_batch(self, states, actions, vals):
+        # Last write wins for repeated (state, action)
+        for state, action, val in zip(states.tolist(), actions.tolist(), vals.tolist()):
+            self.update(state, action, val)
+
+    def load(self, fname):
+        # JSON or binary table, added to the rows already in the table
+        if fname.endswith(BINARY_EXTENSION):
+            self.encoder = read_binary_header(fname)['encoder']
+        keys, values = read_table(fname, self.num_actions)
+        for state, row in zip(keys.tolist(), values):
+            self.values[self.__insert(state)] = row
+
+    def dump(self, fname='qtable.json'):
+        used = np.flatnonzero(self.keys != EMPTY)
+        order = np.argsort(self.keys[used])
+        write_table(fname, self.keys[used][order], self.values[used][order], self.encoder)
+        return "Writing QTable into {}".format(fname)
+
+    def close(self):
+        # Release the arrays before the shared memory they point into
+        self.slots.release()
+        self.header = self.keys = self.values = self.slots = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class QTableUpdates(object):
+    """
+    Experiences sent by a worker to the process writing the QTableShared.
+
+    Sending never blocks a request, experiences arriving while the queue is
+    full are dropped and counted.
+
+    :param updates: Queue read by the writer
+    :type updates: multiprocessing.Queue
+    """
+    def __init__(self, updates):
+        self.updates = updates
+        self.dropped = 0
+
+    def put(self, s, a, s_prime, r):
+        try:
+            self.updates.put_nowait((int(s), int(a), int(s_prime), float(r)))
+        except queue.Full:
+            self.dropped += 1
+
+    def request_snapshot(self):
+        try:
+            self.updates.put_nowait(SNAPSHOT)
+        except queue.Full:
+            self.dropped += 1
@@ -0,0 +1,214 @@
+import glob
+import json
+import os
+import struct
+import threading
+
+import numpy as np
+
+from QTable import write_binary, map_binary, BINARY_EXTENSION
+
+# One journal record per Q table update, last write of a (state, action) wins
+RECORD = np.dtype([('state', '<i8'), ('action', '<i4'), ('value', '<f8')])
+_RECORD_STRUCT = struct.Struct('<qid')
+
+
+def read_table(fname, num_actions):
+    """
+    Read a JSON or binary table into arrays
+
+    :return: (keys, values), keys sorted
+    :rtype: tuple
+    """
+    if not os.path.isfile(fname):
+        return np.zeros(0, dtype='<i8'), np.zeros((0, num_actions))
+    if fname.endswith(BINARY_EXTENSION):
+        _, keys, values = map_binary(fname)
+        return np.array(keys), np.array(values, dtype=float)
+    with open(fname) as f:
+        table = json.load(f)
+    keys = np.array([int(state) for state in table.keys()], dtype='<i8')
+    values = np.array([table[state] for state in table.keys()], dtype=float).reshape(len(keys), num_actions)
+    order = np.argsort(keys)
+    return keys[order], values[order]
+
+
+def write_table(fname, keys, values, encoder):
+    # Write to a temporary file and publish it by an atomic rename
+    tmp = "{}.{}.tmp".format(fname, os.getpid())
+    if fname.endswith(BINARY_EXTENSION):
+        write_binary(tmp, keys, values, encoder)
+    else:
+        with open(tmp, 'w') as f:
+            json.dump({str(int(k)): values[i].tolist() for i, k in enumerate(keys)}, f)
+    os.replace(tmp, fname)
+
+
+def read_journal(fname):
+    with open(fname, 'rb') as f:
+        raw = f.read()
+    # Drop a record cut short by a crash
+    raw = raw[:len(raw) - len(raw) % RECORD.itemsize]
+    return np.frombuffer(raw, dtype=RECORD)
+
+
+def apply_journal(keys, values, records):
+    """
+    Apply journal records to a table, vectorized
+
+    :return: (keys, values) including the states added by the records
+    :rtype: tuple
+    """
+    if len(records) == 0:
+        return keys, values
+    num_actions = values.shape[1]
+
+    # Keep the last write of every (state, action)
+    combined = records['state'] * num_actions + records['action']
+    _, first_of_reversed = np.unique(combined[::-1], return_index=True)
+    last = records[len(records) - 1 - first_of_reversed]
+
+    new_keys = np.union1d(keys, last['state'])
+    new_values = np.ones((len(new_keys), num_actions)) * -1.0
+    new_values[np.searchsorted(new_keys, keys)] = values
+    new_values[np.searchsorted(new_keys, last['state']), last['action']] = last['value']
+    return new_keys, new_values
+
+
+class QTableStore(object):
+    """
+    Persists a Q table as an append-only journal of updates compacted into
+    periodic snapshots.
+
+    Request threads only append a fixed size record to the journal. A
+    background thread rotates the journal, replays the closed segments onto
+    the previous snapshot and publishes the new snapshot by atomic rename.
+    Journal values are absolute, so replaying a segment twice is harmless and
+    a crash at any point recovers by replaying whatever segments remain.
+
+    :param snapshot: Path of the snapshot, JSON or binary by extension
+    :type snapshot: str
+    :param journal: Path prefix of the journal segments
+    :type journal: str
+    :param num_actions: The number of actions available
+    :type num_actions: int
+    :param encoder: ID of the state encoder, recorded in binary snapshots
+    :type encoder: str
+    :param interval: Seconds between snapshots
+    :type interval: float
+    :param flush_interval: Seconds between journal flushes
+    :type flush_interval: float
+    """
+    def __init__(self, snapshot, journal, num_actions, encoder, interval=60.0, flush_interval=1.0):
+        self.snapshot = snapshot
+        self.journal = journal
+        self.num_actions = num_actions
+        self.encoder = encoder
+        self.interval = interval
+        self.flush_interval = flush_interval
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.snapshot_requested = False
+        self.stopped = False
+        self.thread = None
+        self.file = None
+        self.generation = 0
+        self.appended = 0
+        self.snapshots = 0
+
+    def segments(self):
+        # Journal segments, oldest first
+        segments = [s for s in glob.glob(glob.escape(self.journal) + '.*') if s.rsplit('.', 1)[1].isdigit()]
+        return sorted(segments, key=lambda s: int(s.rsplit('.', 1)[1]))
+
+    def recover(self):
+        """
+        Replay every journal segment onto the snapshot, then open a new segment.
+        Called once on startup, before the snapshot is loaded.
+        """
+        # Snapshots interrupted by a crash were never published
+        for tmp in glob.glob(glob.escape(self.snapshot) + '.*.tmp'):
+            os.remove(tmp)
+        segments = self.segments()
+        if segments:
+            self.__compact(segments)
+            self.generation = int(segments[-1].rsplit('.', 1)[1]) + 1
+        self.file = open("{}.{}".format(self.journal, self.generation), 'ab')
+
+    def start(self):
+        if self.file is None:
+            self.recover()
+        self.thread = threading.Thread(target=self.__run, name="qtable-store", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # Flush the journal and write a final snapshot
+        self.stopped = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def append(self, state, action, val):
+        record = _RECORD_STRUCT.pack(int(state), int(action), float(val))
+        with self.lock:
+            self.file.write(record)
+            self.appended += 1
+
+    def append_batch(self, states, actions, vals):
+        records = np.empty(len(states), dtype=RECORD)
+        records['state'] = states
+        records['action'] = actions
+        records['value'] = vals
+        with self.lock:
+            self.file.write(records.tobytes())
+            self.appended += len(records)
+
+    def request_snapshot(self):
+        # Ask the background thread for a snapshot, never blocks
+        self.snapshot_requested = True
+        self.wakeup.set()
+
+    def __run(self):
+        waited = 0.0
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            waited += self.flush_interval
+            # Read once, a stop arriving during a snapshot is handled by the next loop
+            stopping = self.stopped
+            if stopping or self.snapshot_requested or waited >= self.interval:
+                self.snapshot_requested = False
+                waited = 0.0
+                self.__snapshot(force=stopping)
+            else:
+                with self.lock:
+                    self.file.flush()
+            if stopping:
+                with self.lock:
+                    self.file.close()
+                    if self.appended == 0:
+                        os.remove(self.file.name)
+                return
+
+    def __snapshot(self, force=False):
+        # Rotate so the compaction only reads closed segments
+        with self.lock:
+            if self.appended == 0 and not force:
+                return
+            self.file.close()
+            self.generation += 1
+            self.file = open("{}.{}".format(self.journal, self.generation), 'ab')
+            self.appended = 0
+        closed = [s for s in self.segments() if int(s.rsplit('.', 1)[1]) < self.generation]
+        self.__compact(closed)
+
+    def __compact(self, segments):
+        keys, values = read_table(self.snapshot, self.num_actions)
+        for segment in segments:
+            keys, values = apply_journal(keys, values, read_journal(segment))
+        write_table(self.snapshot, keys, values, self.encoder)
+        self.snapshots += 1
+        # Oldest first, so any segments left by a crash are a suffix which replays correctly
+        for segment in segments:
+            os.remove(segment)
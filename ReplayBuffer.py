@@ -0,0 +1,73 @@
+import threading
+
+import numpy as np
+
+EVICTIONS = ('fifo', 'reservoir')
+
+
+class ReplayBuffer(object):
+    """
+    Fixed capacity store of (s, a, s_prime, r) experiences for Dyna-Q.
+
+    Experiences live in preallocated arrays, so memory stays constant however
+    long the learner runs. Once full, FIFO eviction overwrites the oldest
+    experience while reservoir eviction keeps a uniform sample of every
+    experience seen so far.
+
+    :param capacity: The maximum number of experiences kept
+    :type capacity: int
+    :param eviction: 'fifo' or 'reservoir'
+    :type eviction: str
+    """
+    def __init__(self, capacity=100000, eviction='fifo'):
+        if capacity <= 0:
+            raise ValueError("Replay capacity must be positive, got {}".format(capacity))
+        if eviction not in EVICTIONS:
+            raise ValueError("Unknown replay eviction {}, expected one of {}".format(eviction, EVICTIONS))
+        self.capacity = capacity
+        self.eviction = eviction
+        self.s = np.zeros(capacity, dtype=np.int64)
+        self.a = np.zeros(capacity, dtype=np.int32)
+        self.s_prime = np.zeros(capacity, dtype=np.int64)
+        self.r = np.zeros(capacity, dtype=np.float64)
+        self.size = 0
+        self.next = 0 # slot overwritten next by FIFO eviction
+        self.seen = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        return self.s.nbytes + self.a.nbytes + self.s_prime.nbytes + self.r.nbytes
+
+    def add(self, s, a, s_prime, r):
+        with self.lock:
+            self.seen += 1
+            if self.size < self.capacity:
+                i = self.size
+                self.size += 1
+            elif self.eviction == 'fifo':
+                i = self.next
+                self.next = (self.next + 1) % self.capacity
+            else:
+                # Keep the experience with probability capacity / seen
+                i = np.random.randint(0, self.seen)
+                if i >= self.capacity:
+                    return
+            self.s[i] = s
+            self.a[i] = a
+            self.s_prime[i] = s_prime
+            self.r[i] = r
+
+    def sample(self, n):
+        """
+        Sample experiences uniformly with replacement
+
+        :return: (s, a, s_prime, r) arrays of length n
+        :rtype: tuple
+        """
+        with self.lock:
+            i = np.random.randint(0, self.size, size=n)
+            return self.s[i], self.a[i], self.s_prime[i], self.r[i]
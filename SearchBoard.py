@@ -0,0 +1,249 @@
+import random
+from collections import deque
+
+import neighbours
+from Bitboard import popcount
+
+
+class ZobristKeys(object):
+    """
+    Random 64 bit keys of a w * h board: one per cell for the body and the
+    head of every searched snake, and one per cell for food.
+
+    :param w: Width of the board
+    :type w: int
+    :param h: Height of the board
+    :type h: int
+    :param num_snakes: The number of snakes searched
+    :type num_snakes: int
+    """
+    def __init__(self, w, h, num_snakes, seed=0):
+        rng = random.Random(seed)
+        n = w * h
+        self.body = [[rng.getrandbits(64) for _ in range(n)] for _ in range(num_snakes)]
+        self.head = [[rng.getrandbits(64) for _ in range(n)] for _ in range(num_snakes)]
+        self.food = [rng.getrandbits(64) for _ in range(n)]
+
+
+_zobrist_keys = {}
+
+
+def zobrist_keys(w, h, num_snakes):
+    keys = _zobrist_keys.get((w, h, num_snakes))
+    if keys is None:
+        keys = ZobristKeys(w, h, num_snakes)
+        _zobrist_keys[(w, h, num_snakes)] = keys
+    return keys
+
+
+class SearchBoard(object):
+    """
+    Mutable board of the tree search, moved and undone in place.
+
+    Searched snakes (mine first) move with the standard rules: heads move,
+    tails follow unless the snake ate, then snakes out of the board, out of
+    health, on a body or losing a head-to-head are removed. The other snakes
+    stay as obstacles. Cells are linear indices y * w + x, a body is a deque
+    of cells, head first, and every cell counts the body parts on it. The
+    occupied cells and the food are also kept as bitmasks of the bitboard of
+    the turn, so the area of a position is a shift-and-mask flood fill.
+
+    The Zobrist hash covers the bodies and heads of the searched snakes and
+    the food, it is updated with every change.
+
+    :param game: The game state of the turn
+    :type game: GameState.GameState
+    :param snakes: The snakes searched, mine first
+    :type snakes: list
+    :param bitboard: The bitboard of the turn, every body of the board blocks
+    :type bitboard: Bitboard.Bitboard
+    """
+    def __init__(self, game, snakes, bitboard):
+        w = game.w
+        h = game.h
+        self.w = w
+        self.h = h
+        self.nears = neighbours.table(w, h).rows
+        self.keys = zobrist_keys(w, h, len(snakes))
+        n = w * h
+        self.occ = [0] * n
+        self.food = [False] * n
+        self.hash = 0
+        self.bitboard = bitboard
+        self.blocked = bitboard.bodies # cells with occ > 0
+        self.food_mask = 0
+
+        searched = set(snake.id for snake in snakes)
+        for snake in game.snakes:
+            if snake.id in searched:
+                continue
+            for (y, x) in snake.body.tolist():
+                if 0 <= y < h and 0 <= x < w:
+                    self.occ[y * w + x] += 1
+
+        self.bodies = []
+        self.health = []
+        self.alive = []
+        for i, snake in enumerate(snakes):
+            body = deque(y * w + x for (y, x) in snake.body.tolist())
+            for c in body:
+                self.occ[c] += 1
+                self.hash ^= self.keys.body[i][c]
+            self.hash ^= self.keys.head[i][body[0]]
+            self.bodies.append(body)
+            self.health.append(snake.health)
+            self.alive.append(True)
+
+        for (y, x) in game.food.tolist():
+            c = y * w + x
+            if not self.food[c]:
+                self.food[c] = True
+                self.food_mask |= 1 << c
+                self.hash ^= self.keys.food[c]
+
+    def safe_moves(self, i):
+        # Directions which do not hit a wall or a body, tails count as free as they move away
+        body = self.bodies[i]
+        moves = []
+        for a, c in enumerate(self.nears[body[0]]):
+            if c == neighbours.OFF_BOARD:
+                continue
+            if self.occ[c] == 0 or (self.occ[c] == 1 and self.is_tail(c)):
+                moves.append(a)
+        return moves
+
+    def is_tail(self, c):
+        for i, body in enumerate(self.bodies):
+            if self.alive[i] and body[-1] == c:
+                return True
+        return False
+
+    def move(self, moves):
+        """
+        Play one turn
+
+        :param moves: Direction of every searched snake, ignored for dead snakes
+        :type moves: list
+        :return: What undo needs to restore the board
+        :rtype: tuple
+        """
+        keys = self.keys
+        occ = self.occ
+        old_hash = self.hash
+        old_health = list(self.health)
+        old_blocked = blocked = self.blocked
+        moved = []
+        for i, a in enumerate(moves):
+            if not self.alive[i]:
+                continue
+            body = self.bodies[i]
+            head = body[0]
+            new_head = self.nears[head][a]
+            tail = body.pop()
+            occ[tail] -= 1
+            if not occ[tail]:
+                blocked &= ~(1 << tail)
+            self.hash ^= keys.body[i][tail] ^ keys.head[i][head]
+            body.appendleft(new_head)
+            if new_head != neighbours.OFF_BOARD:
+                occ[new_head] += 1
+                blocked |= 1 << new_head
+                self.hash ^= keys.body[i][new_head] ^ keys.head[i][new_head]
+            self.health[i] -= 1
+            moved.append((i, tail))
+
+        # Eating grows the snake by a copy of its last cell, like the engine
+        grown = []
+        eaten = []
+        for i, _ in moved:
+            head = self.bodies[i][0]
+            if head != neighbours.OFF_BOARD and self.food[head]:
+                self.health[i] = 100
+                tail = self.bodies[i][-1]
+                self.bodies[i].append(tail)
+                occ[tail] += 1
+                blocked |= 1 << tail
+                self.hash ^= keys.body[i][tail]
+                grown.append(i)
+                if head not in eaten:
+                    eaten.append(head)
+        for c in eaten:
+            self.food[c] = False
+            self.food_mask &= ~(1 << c)
+            self.hash ^= keys.food[c]
+
+        # Eliminations are decided before any snake is removed
+        heads = {}
+        for i, _ in moved:
+            heads.setdefault(self.bodies[i][0], []).append(i)
+        dead = []
+        for i, _ in moved:
+            head = self.bodies[i][0]
+            if head == neighbours.OFF_BOARD or self.health[i] <= 0 or occ[head] > len(heads[head]):
+                dead.append(i)
+                continue
+            # Head-to-head, the longest snake survives alone
+            others = heads[head]
+            if len(others) > 1:
+                length = len(self.bodies[i])
+                if any(j != i and len(self.bodies[j]) >= length for j in others):
+                    dead.append(i)
+        for i in dead:
+            self.alive[i] = False
+            body = self.bodies[i]
+            if body[0] != neighbours.OFF_BOARD:
+                self.hash ^= keys.head[i][body[0]]
+            for c in body:
+                if c != neighbours.OFF_BOARD:
+                    occ[c] -= 1
+                    if not occ[c]:
+                        blocked &= ~(1 << c)
+                    self.hash ^= keys.body[i][c]
+        self.blocked = blocked
+        return (old_hash, old_health, old_blocked, moved, grown, eaten, dead)
+
+    def undo(self, record):
+        old_hash, old_health, old_blocked, moved, grown, eaten, dead = record
+        occ = self.occ
+        for i in dead:
+            self.alive[i] = True
+            for c in self.bodies[i]:
+                if c != neighbours.OFF_BOARD:
+                    occ[c] += 1
+        for c in eaten:
+            self.food[c] = True
+            self.food_mask |= 1 << c
+        for i in grown:
+            occ[self.bodies[i].pop()] -= 1
+        for i, tail in moved:
+            body = self.bodies[i]
+            head = body.popleft()
+            if head != neighbours.OFF_BOARD:
+                occ[head] -= 1
+            body.append(tail)
+            occ[tail] += 1
+        self.health = old_health
+        self.hash = old_hash
+        self.blocked = old_blocked
+
+    def area(self, i, cap):
+        """
+        Free cells reachable from the head of a snake, counted up to cap
+
+        :return: (cells reached, distance to the closest food or -1)
+        :rtype: tuple
+        """
+        bitboard = self.bitboard
+        passable = bitboard.masks.full & ~self.blocked
+        # Expanded one step at a time from the head, whose layer comes first
+        layers = bitboard.flood_layers(1 << self.bodies[i][0], passable)
+        next(layers)
+        food_distance = -1
+        count = 0
+        for distance, layer in enumerate(layers, 1):
+            if food_distance < 0 and layer & self.food_mask:
+                food_distance = distance
+            count += popcount(layer)
+            if count >= cap:
+                break
+        return min(count, cap), food_distance
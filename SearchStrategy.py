@@ -0,0 +1,256 @@
+import itertools
+import time
+
+import config as cf
+import eventlog
+from SearchBoard import SearchBoard
+
+WIN = 1000000.0
+LOSS = -WIN
+# Values beyond this are decided games, whatever the plies they take
+DECIDED = WIN / 2
+# Bounds of the transposition table entries
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchStrategy(object):
+    """
+    Paranoid alpha-beta search over simultaneous moves.
+
+    Every ply is a full turn: I pick a move, then the nearest opponents pick
+    their moves jointly against me. Iterative deepening searches one more turn
+    at a time until the deadline of the turn or the maximum depth, and every
+    depth starts from the best move of the previous one. Positions reached
+    again, by another order of moves or at another depth, are read from a
+    transposition table keyed by the Zobrist hash of the board.
+    """
+    def __init__(self, raw_config):
+        # Load learner parameters from learner.json
+        config = cf.LearnerConfig(raw_config)
+        self.num_actions = config.num_actions
+        self.config = cf.SearchConfig(raw_config)
+        # Last search, read by the metrics
+        self.last_depth = 0
+        self.last_nodes_per_second = 0.0
+
+    def start(self, data, session):
+        pass
+
+    def end(self, data, session):
+        pass
+
+    def move(self, data, ctx):
+        possible_moves = ["up", "down", "left", "right"]
+        best, _ = self.search(ctx)
+        if best is None:
+            return None
+        return possible_moves[best]
+
+    def override(self, data, ctx, move):
+        """
+        Replace a move which the search proves losing, when another move is not
+
+        :param move: The move chosen by another strategy
+        :type move: str
+        :return: The move of the search, None to keep the move
+        :rtype: str
+        """
+        possible_moves = ["up", "down", "left", "right"]
+        best, values = self.search(ctx)
+        a = possible_moves.index(move)
+        if best is None or best == a or values.get(a, LOSS) > -DECIDED or values[best] <= -DECIDED:
+            return None
+        return possible_moves[best]
+
+    def search(self, ctx):
+        """
+        Iterative deepening search of the turn
+
+        :param ctx: The context of the turn
+        :type ctx: TurnContext.TurnContext
+        :return: The best direction (None if no depth completed) and the value
+                 of every direction at the last completed depth. The value of
+                 the best direction is exact, the others are upper bounds.
+        :rtype: (int, dict)
+        """
+        with ctx.timed('search'):
+            game = ctx.game
+            # The nearest opponents are searched, the others stay as obstacles
+            head_y, head_x = game.you.head
+            others = sorted(game.others(), key=lambda snake: abs(snake.head[0] - head_y) + abs(snake.head[1] - head_x))
+            snakes = [game.you] + others[:self.config.max_opponents]
+            tree = TreeSearch(SearchBoard(game, snakes, ctx.bitboard), self.config, ctx, self.num_actions, len(others) == len(snakes) - 1)
+
+            best = None
+            values = {}
+            depth = 0
+            start = time.perf_counter()
+            last_elapsed = 0.0
+            for d in range(1, self.config.max_depth + 1):
+                try:
+                    move, depth_values = tree.root(d, best)
+                except SearchTimeout:
+                    break
+                best = move
+                values = depth_values
+                depth = d
+                if abs(values[best]) >= DECIDED:
+                    break
+                # Stop when the next depth would not finish, guessing it takes as much longer as the last one did
+                elapsed = time.perf_counter() - start
+                if last_elapsed > 0 and elapsed * elapsed / last_elapsed > elapsed + ctx.time_left():
+                    break
+                last_elapsed = elapsed
+            seconds = time.perf_counter() - start
+
+        self.last_depth = depth
+        self.last_nodes_per_second = tree.nodes / seconds if seconds > 0 else 0.0
+        eventlog.debug("search", game=game.unique_id(), turn=game.turn, depth=depth, nodes=tree.nodes,
+                       nodes_per_second=round(self.last_nodes_per_second), positions=len(tree.table))
+        return best, values
+
+
+class TreeSearch(object):
+    """
+    Search state of one turn, the strategy is shared by concurrent games.
+
+    :param board: The board, moved and undone during the search
+    :type board: SearchBoard.SearchBoard
+    :param config: Search settings
+    :type config: config.SearchConfig
+    :param ctx: The context of the turn, for its deadline
+    :type ctx: TurnContext.TurnContext
+    :param num_actions: The number of actions available
+    :type num_actions: int
+    :param complete: Every opponent is searched, so killing them all wins the game
+    :type complete: bool
+    """
+    def __init__(self, board, config, ctx, num_actions, complete):
+        self.board = board
+        self.config = config
+        self.ctx = ctx
+        self.num_actions = num_actions
+        self.complete = complete
+        self.table = {} # Zobrist hash -> (depth, value, bound, best move)
+        self.nodes = 0
+
+    def root(self, depth, first):
+        board = self.board
+        moves = board.safe_moves(0) or list(range(self.num_actions))
+        if first in moves:
+            moves.remove(first)
+            moves.insert(0, first)
+        values = {}
+        best = moves[0]
+        alpha = LOSS - 1
+        for a in moves:
+            v = self.__opponents(a, depth, alpha, WIN + 1, 0)
+            values[a] = v
+            if v > alpha:
+                alpha = v
+                best = a
+        return best, values
+
+    def __mine(self, depth, alpha, beta, ply):
+        # Value of the board for me, once every snake has moved
+        self.nodes += 1
+        if self.nodes & 15 == 0 and self.ctx.expired():
+            raise SearchTimeout()
+
+        board = self.board
+        if not board.alive[0]:
+            # Dying later is better
+            return LOSS + ply
+        if self.complete and len(board.alive) > 1 and not any(board.alive[1:]):
+            return WIN - ply
+        if depth == 0:
+            return self.__evaluate()
+
+        entry = self.table.get(board.hash)
+        first = None
+        if entry is not None:
+            entry_depth, value, bound, first = entry
+            if entry_depth >= depth:
+                if bound == EXACT:
+                    return value
+                if bound == LOWER and value >= beta:
+                    return value
+                if bound == UPPER and value <= alpha:
+                    return value
+
+        moves = board.safe_moves(0) or [0]
+        if first in moves:
+            moves.remove(first)
+            moves.insert(0, first)
+        original_alpha = alpha
+        best_value = LOSS - 1
+        best = moves[0]
+        for a in moves:
+            v = self.__opponents(a, depth, alpha, beta, ply)
+            if v > best_value:
+                best_value = v
+                best = a
+            if v > alpha:
+                alpha = v
+            if alpha >= beta:
+                break
+
+        if best_value <= original_alpha:
+            bound = UPPER
+        elif best_value >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table[board.hash] = (depth, best_value, bound, best)
+        return best_value
+
+    def __opponents(self, a, depth, alpha, beta, ply):
+        # Lowest value of my move over the joint moves of the opponents
+        board = self.board
+        choices = [[a]]
+        for i in range(1, len(board.alive)):
+            if board.alive[i]:
+                choices.append(board.safe_moves(i) or [0])
+            else:
+                choices.append([0])
+        worst = WIN + 1
+        for moves in itertools.product(*choices):
+            record = board.move(moves)
+            try:
+                v = self.__mine(depth - 1, alpha, beta, ply + 1)
+            finally:
+                board.undo(record)
+            if v < worst:
+                worst = v
+            if worst < beta:
+                beta = worst
+            if alpha >= beta:
+                break
+        return worst
+
+    def __evaluate(self):
+        # Space around my head first, then being longer than the opponents, then food when hungry
+        board = self.board
+        key = board.hash
+        entry = self.table.get(key)
+        if entry is not None and entry[2] == EXACT:
+            return entry[1]
+
+        area, food_distance = board.area(0, self.config.area_cap)
+        length = len(board.bodies[0])
+        longest = 0
+        for i in range(1, len(board.alive)):
+            if board.alive[i]:
+                longest = max(longest, len(board.bodies[i]))
+        value = area + self.config.length_weight * (length - longest)
+        if board.health[0] < self.config.hungry_health and food_distance >= 0:
+            value -= food_distance
+        if entry is None:
+            self.table[key] = (0, value, EXACT, None)
+        return value
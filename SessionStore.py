@@ -0,0 +1,122 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import util
+from BoardCache import BoardCache
+
+# Request and response header carrying the checkpoint of a session between the dispatcher and the workers
+CHECKPOINT_HEADER = "X-Battlesnake-Session"
+
+
+class Session(object):
+    """
+    All per-game state of one snake in one game.
+
+    :param session_id: The util.unique_id of the game
+    :type session_id: str
+    :param now: Creation time from the store clock
+    :type now: float
+    """
+    def __init__(self, session_id, now):
+        self.id = session_id
+        self.created = now
+        self.last_seen = now
+        # QLearner: state and action of the previous turn
+        self.s = 0
+        self.a = 0
+        # QLearnerStrategy: health and length of the previous turn, health threshold
+        self.prev_state = None
+        self.health_threshold = None
+        # TurnContext: board of the previous turn
+        self.board = BoardCache()
+
+    def nbytes(self):
+        # Shallow size of the session and its attributes, with the arrays of the board
+        return (sys.getsizeof(self) + sys.getsizeof(self.__dict__) + sum(sys.getsizeof(v) for v in self.__dict__.values())
+                + self.board.nbytes())
+
+
+class SessionStore(object):
+    """
+    Sessions of the games in progress, keyed by util.unique_id.
+
+    Sessions are kept in least recently used order, so both evictions only
+    look at the oldest sessions: a session idle for longer than ttl seconds
+    expires, and above max_sessions the least recently used one is dropped.
+    A game which never receives its end request therefore only holds memory
+    until it expires.
+
+    :param ttl: Seconds a session may stay idle
+    :type ttl: float
+    :param max_sessions: The maximum number of sessions kept
+    :type max_sessions: int
+    """
+    def __init__(self, ttl=600.0, max_sessions=10000, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.clock = clock
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def start(self, data):
+        # New session of the game, replacing any previous one
+        session_id = util.unique_id(data)
+        now = self.clock()
+        session = Session(session_id, now)
+        with self.lock:
+            self.sessions.pop(session_id, None)
+            self.sessions[session_id] = session
+            self.__evict(now)
+        return session
+
+    def get(self, data):
+        # Session of the game, a new one if the start was missed or the session evicted
+        session_id = util.unique_id(data)
+        now = self.clock()
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = Session(session_id, now)
+                self.sessions[session_id] = session
+            else:
+                self.sessions.move_to_end(session_id)
+            session.last_seen = now
+            self.__evict(now)
+        return session
+
+    def end(self, data):
+        # Remove and return the session of the game, None if there is none
+        with self.lock:
+            return self.sessions.pop(util.unique_id(data), None)
+
+    def nbytes(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        return sys.getsizeof(self.sessions) + sum(session.nbytes() for session in sessions)
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "bytes": self.nbytes(),
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+    def __evict(self, now):
+        # Oldest sessions first, stops at the first one kept
+        while self.sessions:
+            session_id, session = next(iter(self.sessions.items()))
+            if len(self.sessions) > self.max_sessions:
+                self.evicted += 1
+            elif now - session.last_seen > self.ttl:
+                self.expired += 1
+            else:
+                break
+            del self.sessions[session_id]
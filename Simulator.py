@@ -0,0 +1,350 @@
+"""
+Headless Battlesnake game simulator implementing the standard ruleset.
+
+Players are called in-process with the same payload shape as the Battlesnake
+engine sends (see test-data.json), no HTTP is involved.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import eventlog
+
+MOVES = ("up", "down", "left", "right")
+# (dy, dx) of each move
+DELTAS = {
+    "up": (1, 0),
+    "down": (-1, 0),
+    "left": (0, -1),
+    "right": (0, 1),
+}
+
+
+class ServerPlayer(object):
+    """
+    Player backed by an in-process server.Battlesnake instance.
+    """
+    def __init__(self, server):
+        self.server = server
+
+    def start(self, data):
+        self.server.handle_start(data)
+
+    def move(self, data):
+        return self.server.handle_move(data)["move"]
+
+    def end(self, data):
+        self.server.handle_end(data)
+
+
+class RandomPlayer(object):
+    """
+    Player moving to a random neighbour which is not a wall or a snake body.
+    """
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+    def start(self, data):
+        pass
+
+    def move(self, data):
+        board = data['board']
+        head = data['you']['head']
+        occupied = set()
+        for snake in board['snakes']:
+            for pos in snake['body'][:-1]:
+                occupied.add((pos['y'], pos['x']))
+        safe = []
+        for move in MOVES:
+            dy, dx = DELTAS[move]
+            y, x = head['y'] + dy, head['x'] + dx
+            if 0 <= y < board['height'] and 0 <= x < board['width'] and (y, x) not in occupied:
+                safe.append(move)
+        if not safe:
+            return "up"
+        return safe[self.rng.integers(len(safe))]
+
+    def end(self, data):
+        pass
+
+
+class SnakeState(object):
+    def __init__(self, snake_id, name, body, health=100):
+        self.id = snake_id
+        self.name = name
+        self.body = body # list of (y, x), head first
+        self.health = health
+        self.eliminated_cause = None
+        self.eliminated_turn = None
+
+    @property
+    def alive(self):
+        return self.eliminated_cause is None
+
+    def to_dict(self):
+        body = [{"x": x, "y": y} for (y, x) in self.body]
+        return {
+            "id": self.id,
+            "name": self.name,
+            "health": self.health,
+            "body": body,
+            "latency": "0",
+            "head": body[0],
+            "length": len(body),
+            "shout": "",
+            "squad": "",
+        }
+
+
+class Game(object):
+    """
+    One game of the standard ruleset.
+
+    :param width: Width of the board
+    :type width: int
+    :param height: Height of the board
+    :type height: int
+    :param num_snakes: The number of snakes
+    :type num_snakes: int
+    :param seed: Seed of the game random generator, used for spawning and food
+    :type seed: int
+    :param timeout: The game.timeout sent to players in milliseconds
+    :type timeout: int
+    :param food_spawn_chance: Percentage chance of spawning a food each turn
+    :type food_spawn_chance: int
+    :param minimum_food: The minimum number of food on the board
+    :type minimum_food: int
+    :param game_id: The game ID sent to players
+    :type game_id: str
+    """
+    def __init__(
+        self,
+        width=11,
+        height=11,
+        num_snakes=4,
+        seed=None,
+        timeout=500,
+        food_spawn_chance=15,
+        minimum_food=1,
+        game_id=None,
+    ):
+        self.width = width
+        self.height = height
+        self.timeout = timeout
+        self.food_spawn_chance = food_spawn_chance
+        self.minimum_food = minimum_food
+        self.rng = np.random.default_rng(seed)
+        self.game_id = game_id if game_id is not None else "sim-{}".format(self.rng.integers(1 << 62))
+        self.turn = 0
+        self.food = []
+
+        # Snakes start stacked on random cells of the same parity, like the engine
+        cells = [i for i in range(width * height) if (i // width + i % width) % 2 == 0]
+        if num_snakes > len(cells):
+            raise ValueError("Too many snakes for a {}x{} board".format(width, height))
+        starts = self.rng.choice(cells, size=num_snakes, replace=False)
+        self.snakes = []
+        for n, i in enumerate(starts):
+            y, x = divmod(int(i), width)
+            self.snakes.append(SnakeState("snake-{}".format(n), "snake-{}".format(n), [(y, x)] * 3))
+
+        # One food per snake plus the center
+        self.spawn_food(num_snakes)
+        center = (height // 2, width // 2)
+        if center not in self.food and not self.occupied()[center]:
+            self.food.append(center)
+
+    def occupied(self):
+        # Boolean grid of snake bodies and food
+        grid = np.zeros((self.height, self.width), dtype=bool)
+        for snake in self.snakes:
+            if snake.alive:
+                for (y, x) in snake.body:
+                    # Snakes moved out of bounds are only eliminated after food spawns
+                    if 0 <= y < self.height and 0 <= x < self.width:
+                        grid[y, x] = True
+        for (y, x) in self.food:
+            grid[y, x] = True
+        return grid
+
+    def spawn_food(self, n):
+        free = np.flatnonzero(~self.occupied())
+        n = min(n, len(free))
+        if n <= 0:
+            return
+        for i in self.rng.choice(free, size=n, replace=False):
+            self.food.append(divmod(int(i), self.width))
+
+    def alive_snakes(self):
+        return [snake for snake in self.snakes if snake.alive]
+
+    def is_over(self):
+        alive = len(self.alive_snakes())
+        if len(self.snakes) == 1:
+            return alive == 0
+        return alive <= 1
+
+    def payload(self, you, board=None):
+        # Request body of the turn for the given snake, same shape as test-data.json
+        if board is None:
+            board = self.board_payload()
+        return {
+            "game": {
+                "id": self.game_id,
+                "ruleset": {"name": "standard", "version": "v1.0.0"},
+                "timeout": self.timeout,
+            },
+            "turn": self.turn,
+            "board": board,
+            "you": you.to_dict(),
+        }
+
+    def board_payload(self):
+        return {
+            "height": self.height,
+            "width": self.width,
+            "food": [{"x": x, "y": y} for (y, x) in self.food],
+            "hazards": [],
+            "snakes": [snake.to_dict() for snake in self.snakes if snake.alive],
+        }
+
+    def step(self, moves):
+        """
+        Apply one turn of the standard ruleset.
+
+        :param moves: The move of every alive snake keyed by snake ID, invalid moves count as "up"
+        :type moves: dict
+        """
+        alive = self.alive_snakes()
+
+        # Move
+        for snake in alive:
+            dy, dx = DELTAS.get(moves.get(snake.id), DELTAS["up"])
+            head = snake.body[0]
+            snake.body.insert(0, (head[0] + dy, head[1] + dx))
+            snake.body.pop()
+
+        # Reduce health
+        for snake in alive:
+            snake.health -= 1
+
+        # Feed
+        eaten = set()
+        for snake in alive:
+            if snake.body[0] in self.food:
+                eaten.add(snake.body[0])
+                snake.health = 100
+                snake.body.append(snake.body[-1])
+        if eaten:
+            self.food = [pos for pos in self.food if pos not in eaten]
+
+        # Spawn food
+        if len(self.food) < self.minimum_food:
+            self.spawn_food(self.minimum_food - len(self.food))
+        elif self.food_spawn_chance > 0 and self.rng.integers(100) < self.food_spawn_chance:
+            self.spawn_food(1)
+
+        # Eliminate starving and out of bounds snakes first
+        for snake in alive:
+            (y, x) = snake.body[0]
+            if snake.health <= 0:
+                snake.eliminated_cause = "starvation"
+            elif y < 0 or x < 0 or y >= self.height or x >= self.width:
+                snake.eliminated_cause = "wall-collision"
+        survivors = [snake for snake in alive if snake.alive]
+
+        # Collisions are checked against every snake which survived the first phase
+        collisions = {}
+        for snake in survivors:
+            head = snake.body[0]
+            if head in snake.body[1:]:
+                collisions[snake.id] = "self-collision"
+                continue
+            for other in survivors:
+                if other is snake:
+                    continue
+                if head in other.body[1:]:
+                    collisions[snake.id] = "snake-collision"
+                    break
+                if head == other.body[0] and len(snake.body) <= len(other.body):
+                    collisions[snake.id] = "head-collision"
+                    break
+        for snake in survivors:
+            if snake.id in collisions:
+                snake.eliminated_cause = collisions[snake.id]
+
+        for snake in alive:
+            if not snake.alive:
+                snake.eliminated_turn = self.turn + 1
+        self.turn += 1
+
+    def run(self, players, max_turns=None):
+        """
+        Play the game to the end.
+
+        :param players: One player per snake, with start(data), move(data) and end(data)
+        :type players: list
+        :param max_turns: Stop after this many turns if given
+        :type max_turns: int
+        :return: The ID of the winner, None on a draw
+        :rtype: str
+        """
+        if len(players) != len(self.snakes):
+            raise ValueError("Expected {} players, got {}".format(len(self.snakes), len(players)))
+        by_id = {snake.id: player for snake, player in zip(self.snakes, players)}
+
+        for snake in self.snakes:
+            by_id[snake.id].start(self.payload(snake))
+
+        while not self.is_over() and (max_turns is None or self.turn < max_turns):
+            # The board is shared by every payload of the turn, players must not modify it
+            board = self.board_payload()
+            moves = {}
+            for snake in self.alive_snakes():
+                moves[snake.id] = by_id[snake.id].move(self.payload(snake, board))
+            self.step(moves)
+
+        # Every snake receives the final board, eliminated ones included
+        for snake in self.snakes:
+            by_id[snake.id].end(self.payload(snake))
+
+        alive = self.alive_snakes()
+        return alive[0].id if len(alive) == 1 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run headless self-play games of the server strategies")
+    parser.add_argument("--games", type=int, default=10)
+    parser.add_argument("--width", type=int, default=11)
+    parser.add_argument("--height", type=int, default=11)
+    parser.add_argument("--snakes", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--random", action="store_true", help="use random players instead of the server")
+    args = parser.parse_args()
+
+    if args.random:
+        players = [RandomPlayer(args.seed + n) for n in range(args.snakes)]
+    else:
+        import server
+        player = ServerPlayer(server.Battlesnake())
+        players = [player] * args.snakes
+
+    turns = 0
+    wins = {}
+    start = time.perf_counter()
+    for n in range(args.games):
+        game = Game(args.width, args.height, args.snakes, seed=args.seed + n, game_id="sim-{}".format(n))
+        winner = game.run(players)
+        wins[winner] = wins.get(winner, 0) + 1
+        turns += game.turn
+    elapsed = time.perf_counter() - start
+    # Write the queued server logs before the summary
+    eventlog.stop()
+
+    print("Played {} games, {} turns in {:.2f}s ({:.0f} games/min)".format(args.games, turns, elapsed, args.games / elapsed * 60))
+    print("Winners: {}".format(wins))
+
+
+if __name__ == "__main__":
+    main()
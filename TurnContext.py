@@ -0,0 +1,205 @@
+import contextlib
+import time
+
+import neighbours
+import util
+from Bitboard import Bitboard
+from DistanceField import DistanceFields
+from GameState import GameState
+
+
+class DeadlineExpired(Exception):
+    """
+    Raised by a route search starting after the deadline of the turn.
+    """
+
+
+class LazyRoutes(object):
+    """
+    List-like view over the number of possible routes toward each direction.
+
+    A direction is only searched the first time it is indexed, iterating
+    searches every missing direction at once. Blocked directions report -1
+    without running any search. A search is not started after the deadline,
+    DeadlineExpired is raised instead.
+    """
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.values = [None] * ctx.num_actions
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, a):
+        if self.values[a] is None:
+            self.values[a] = self.ctx.compute_routes([a])[0]
+        return self.values[a]
+
+    def __iter__(self):
+        missing = [a for a in range(len(self.values)) if self.values[a] is None]
+        if missing:
+            for a, r in zip(missing, self.ctx.compute_routes(missing)):
+                self.values[a] = r
+        return iter(self.values)
+
+    def computed(self):
+        # Directions which have been searched so far
+        return [a for a in range(len(self.values)) if self.values[a] is not None]
+
+
+class TurnContext(object):
+    """
+    Per-turn board analysis shared by all strategies.
+
+    Every derived quantity is computed on first access and memoized, so a
+    strategy only pays for what it actually reads and nothing is computed twice
+    in the same turn.
+
+    :param data: The request payload of the turn, parsed into game
+    :type data: dict
+    :param num_actions: The number of actions available
+    :type num_actions: int
+    :param session: The session of the game
+    :type session: SessionStore.Session
+    :param deadline: time.monotonic() by which the move must be decided, None for no deadline
+    :type deadline: float
+    :param timings: Seconds already spent in stages before the context, e.g. decoding JSON
+    :type timings: dict
+    """
+    def __init__(self, data, num_actions=4, session=None, deadline=None, timings=None):
+        self.data = data
+        self.num_actions = num_actions
+        self.session = session
+        self.deadline = deadline
+        # Last stage of the move pipeline which completed
+        self.stage = None
+        # Seconds spent in every stage, excluding the stages nested in it
+        self.timings = dict(timings) if timings else {}
+        self._timers = [] # [start, seconds in nested stages] of the running stages
+        # Parsed once, strategies read the game state instead of the request dicts
+        with self.timed('game_state'):
+            self.game = GameState.from_data(data)
+        self.h = self.game.h
+        self.w = self.game.w
+        self.head = self.game.you.head # (y, x)
+
+        self._states = None
+        self._bitboard = None
+        self._block_arr = None
+        self._routes = LazyRoutes(self)
+        self._fields = None
+        self._food_signals = None
+        self._discretized = {}
+
+    @property
+    def states(self):
+        # 0 = empty
+        # 1 = barrier
+        # 2 = food
+        # 3 = head
+        # 4 = my tail
+        if self._states is None:
+            with self.timed('construct_borad'):
+                if self.session is not None:
+                    # Updated from the board of the previous turn
+                    self._states = self.session.board.update(self.game)
+                else:
+                    self._states = util.construct_board(self.game)
+        return self._states
+
+    @property
+    def bitboard(self):
+        # Only read by the search
+        if self._bitboard is None:
+            if self.session is not None:
+                # The cache holds the bodies of this turn once the grid is read
+                self.states
+                self._bitboard = self.session.board.bitboard()
+            else:
+                self._bitboard = Bitboard.from_state(self.game)
+        return self._bitboard
+
+    @property
+    def block_arr(self):
+        if self._block_arr is None:
+            with self.timed('determine_block_array'):
+                self._block_arr = util.block_array(self.game, self.states, self.num_actions)
+        return self._block_arr
+
+    @property
+    def routes(self):
+        return self._routes
+
+    @property
+    def fields(self):
+        # BFS distance fields from my head and the opponent heads
+        if self._fields is None:
+            self._fields = DistanceFields(self.game, self.states)
+        return self._fields
+
+    @property
+    def food_signals(self):
+        if self._food_signals is None:
+            self._food_signals = self.fields.food_signals()
+        return self._food_signals
+
+    @contextlib.contextmanager
+    def timed(self, stage):
+        # Add the time spent in the block to the stage, minus the stages nested in it
+        timer = [time.perf_counter(), 0.0]
+        self._timers.append(timer)
+        try:
+            yield
+        finally:
+            self._timers.pop()
+            elapsed = time.perf_counter() - timer[0]
+            self.timings[stage] = self.timings.get(stage, 0.0) + elapsed - timer[1]
+            if self._timers:
+                self._timers[-1][1] += elapsed
+
+    def time_left(self):
+        # Seconds left before the deadline
+        if self.deadline is None:
+            return float('inf')
+        return self.deadline - time.monotonic()
+
+    def expired(self):
+        return self.time_left() <= 0
+
+    def neighbour(self, a):
+        # Position of the cell next to my head toward ["up", "down", "left", "right"]
+        y, x = self.head
+        dy, dx = neighbours.DELTAS[a]
+        return y + dy, x + dx
+
+    def compute_routes(self, dirrs):
+        routes = [-1] * len(dirrs)
+        open_dirrs = [i for i, a in enumerate(dirrs) if not self.block_arr[a]]
+        if not open_dirrs:
+            return routes
+
+        head_y, head_x = self.head
+        with self.timed('routes'):
+            for i in open_dirrs:
+                # One direction at a time, a search cannot be interrupted
+                if self.expired():
+                    raise DeadlineExpired()
+                routes[i] = util.calculate_possible_routes(head_y, head_x, dirrs[i], self.w, self.h, self.states)
+        return routes
+
+    def discretize(self, health_threshold):
+        """
+        Discretize the turn into a state based on possible routes.
+
+        :param health_threshold: Health below which the snake counts as dying
+        :type health_threshold: float
+        :return: The discretized state and the block array
+        :rtype: (int, array(boolean))
+        """
+        if health_threshold not in self._discretized:
+            with self.timed('discretize'):
+                # Blocked directions have no routes
+                routes = [max(r, 0) for r in self.routes]
+                is_dying = 0 if self.game.you.health > health_threshold else 1
+                self._discretized[health_threshold] = util.encode_possible_routes(routes, self.food_signals, is_dying)
+        return self._discretized[health_threshold], self.block_arr
@@ -0,0 +1,107 @@
+import numpy as np
+
+import config as cf
+
+
+def dilate(masks):
+    # Cells next to the cells of the masks, the last two axes are (y, x)
+    grown = np.zeros_like(masks)
+    grown[..., 1:, :] |= masks[..., :-1, :]
+    grown[..., :-1, :] |= masks[..., 1:, :]
+    grown[..., :, 1:] |= masks[..., :, :-1]
+    grown[..., :, :-1] |= masks[..., :, 1:]
+    return grown
+
+
+class VoronoiStrategy(object):
+    """
+    Move which controls the most territory.
+
+    Every open direction is scored at once: the frontiers of all snakes grow
+    one cell per step as boolean masks of shape (directions, snakes, h, w),
+    my snake starting from the cell the direction enters and the others from
+    their heads. A cell reached by several snakes on the same step goes to the
+    longest one, and to nobody when the longest ones have the same length.
+    """
+    def __init__(self, raw_config):
+        # Load learner parameters from learner.json
+        config = cf.LearnerConfig(raw_config)
+        self.num_actions = config.num_actions
+        self.config = cf.VoronoiConfig(raw_config)
+
+    def start(self, data, session):
+        pass
+
+    def end(self, data, session):
+        pass
+
+    def move(self, data, ctx):
+        possible_moves = ["up", "down", "left", "right"]
+        moves = [a for a in range(self.num_actions) if not ctx.block_arr[a]]
+        if not moves:
+            return None
+
+        with ctx.timed('voronoi'):
+            cells, food = self.territory(ctx, moves)
+
+        if ctx.game.you.health < self.config.hungry_health:
+            food_weight = self.config.hungry_food_weight
+        else:
+            food_weight = self.config.food_weight
+        # Mine is the first snake
+        scores = cells[:, 0] + food_weight * food[:, 0]
+        return possible_moves[moves[int(np.argmax(scores))]]
+
+    def territory(self, ctx, moves):
+        """
+        Territory of every snake after each of my moves
+
+        :param ctx: The context of the turn
+        :type ctx: TurnContext.TurnContext
+        :param moves: The directions to score
+        :type moves: list
+        :return: Cells and food owned, arrays of shape (moves, snakes), my snake first
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        game = ctx.game
+        states = ctx.states
+        free = (states != 1) & (states != 3)
+        snakes = [game.you] + game.others()
+        lengths = np.array([snake.length for snake in snakes])
+
+        m = len(moves)
+        k = len(snakes)
+        claimed = np.zeros((m, game.h, game.w), dtype=bool)
+        reach = np.zeros((m, k, game.h, game.w), dtype=bool)
+        heads = np.zeros((k, game.h, game.w), dtype=bool)
+        for i, snake in enumerate(snakes):
+            if game.is_inside(*snake.head):
+                heads[(i,) + snake.head] = True
+        claimed[:] = heads.any(axis=0)
+
+        # First step, my snake has already moved
+        for j, a in enumerate(moves):
+            reach[(j, 0) + ctx.neighbour(a)] = True
+        reach[:, 1:] = dilate(heads[1:]) & free
+
+        owned = np.zeros((m, k, game.h, game.w), dtype=bool)
+        while True:
+            reach &= ~claimed[:, None]
+            if not reach.any():
+                break
+            # The longest snake wins a contested cell, a tie leaves it to nobody
+            contender_lengths = np.where(reach, lengths[None, :, None, None], -1)
+            longest = contender_lengths.max(axis=1)
+            winners = reach & (contender_lengths == longest[:, None])
+            won = winners & (winners.sum(axis=1) == 1)[:, None]
+            owned |= won
+            claimed |= reach.any(axis=1)
+            if ctx.expired():
+                # Territory grown so far, still comparable between the moves
+                break
+            reach = dilate(won) & free
+
+        food_cells = states == 2
+        cells = owned.sum(axis=(2, 3))
+        food = (owned & food_cells).sum(axis=(2, 3))
+        return cells, food
@@ -0,0 +1,8 @@
+"""
+Benchmarks of the move path over a corpus of recorded /move payloads.
+
+    python -m benchmark.corpus                       # record the corpus, done by run when missing
+    python -m benchmark.run --out results.json       # micro and end-to-end benchmarks
+    python -m benchmark.run --baseline results.json  # fail when a p99 got worse than the threshold
+    python -m benchmark.loadtest --concurrency 20    # concurrent games against a server.py process
+"""
@@ -0,0 +1,91 @@
+"""
+Benchmark cases: util functions, board analysis, strategies and the whole move.
+
+Every case is (name, setup, call): setup(sample) builds the arguments of one
+call outside of the timing, call(*args) is timed. Strategies are timed on a
+fresh TurnContext, so they include the board analysis they trigger, like in
+a real turn.
+"""
+import copy
+
+import util
+from Bitboard import Bitboard
+from DistanceField import DistanceFields
+from GameState import GameState
+from SessionStore import Session
+from TurnContext import TurnContext
+
+
+class Sample(object):
+    """
+    One payload of the corpus, parsed once for the cases which do not time the parsing.
+
+    :param entry: {"bucket", "data"} entry of the corpus
+    :type entry: dict
+    """
+    def __init__(self, entry):
+        self.bucket = entry['bucket']
+        self.data = entry['data']
+        self.game = GameState.from_data(self.data)
+        self.states = util.construct_board(self.game)
+        self.size = "{}x{}".format(self.game.w, self.game.h)
+
+
+def server_config(raw_config, strategy='default'):
+    # Quiet server settings running the given strategy
+    raw_config = copy.deepcopy(raw_config)
+    raw_config.setdefault('runtime', {})['strategy'] = strategy
+    raw_config['logging'] = {"level": "error"}
+    # A shallow search, benchmarks measure the search speed, not its time budget
+    raw_config['search'] = dict(raw_config.get('search', {}), max_depth=2)
+    return raw_config
+
+
+def build(raw_config):
+    """
+    All cases, sharing one server per strategy
+
+    :param raw_config: The content of learner.json
+    :type raw_config: dict
+    :return: [(name, setup, call)]
+    :rtype: list
+    """
+    import server
+    battlesnake = server.Battlesnake(server_config(raw_config))
+    voronoi = server.Battlesnake(server_config(raw_config, 'voronoi'))
+    search = server.Battlesnake(server_config(raw_config, 'search'))
+    num_actions = battlesnake.num_actions
+
+    def head(sample):
+        return sample.game.you.head
+
+    def context(sample):
+        ctx = TurnContext(sample.data, num_actions, Session("bench", 0.0))
+        return (sample.data, ctx)
+
+    def routes(sample):
+        y, x = head(sample)
+        return (y, x, sample.game.w, sample.game.h, sample.states)
+
+    cases = [
+        ("util.construct_borad", lambda sample: (sample.data,), util.construct_borad),
+        ("util.construct_board", lambda sample: (sample.game,), util.construct_board),
+        ("util.block_array", lambda sample: (sample.game, sample.states, num_actions), util.block_array),
+        ("util.calculate_possible_routes", routes,
+         lambda y, x, w, h, states: [util.calculate_possible_routes(y, x, a, w, h, states) for a in range(num_actions)]),
+        ("util.food_signals", lambda sample: (sample.states,) + head(sample) + (sample.game.w, sample.game.h), util.food_signals),
+        ("util.discretize", lambda sample: (sample.data, num_actions, 100), util.discretize),
+        ("GameState.from_data", lambda sample: (sample.data,), GameState.from_data),
+        ("Bitboard.from_state", lambda sample: (sample.game,), Bitboard.from_state),
+        ("DistanceFields.mine", lambda sample: (sample.game, sample.states), lambda game, states: DistanceFields(game, states).mine),
+        ("TurnContext.discretize", context, lambda data, ctx: ctx.discretize(100)),
+        ("HeadStrategy.move", context, battlesnake.headStrategy.move),
+        ("FoodStrategy.move", context, battlesnake.foodStrategy.move),
+        ("QLearnerStrategy.move", context, battlesnake.qlearnerStrategy.move),
+        ("VoronoiStrategy.move", context, voronoi.voronoiStrategy.move),
+        ("SearchStrategy.move", context, search.searchStrategy.move),
+        # The whole move request in-process, JSON decoding excluded
+        ("Battlesnake.move", lambda sample: (sample.data,), battlesnake.handle_move),
+        ("Battlesnake.move[voronoi]", lambda sample: (sample.data,), voronoi.handle_move),
+    ]
+    return cases
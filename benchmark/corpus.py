@@ -0,0 +1,213 @@
+"""
+Corpus of /move payloads recorded from simulated games.
+
+Games of every board size and number of snakes are played by greedy players
+which chase food and avoid walls and bodies, so bodies grow long and boards
+fill up like in real games, without depending on the strategies being
+benchmarked. Payloads are sampled along the games and bucketed by board size,
+number of snakes, body length and layout, each bucket keeping at most a fixed
+number of payloads.
+
+    python -m benchmark.corpus --out benchmark/corpus.json
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import Simulator as sim
+
+SIZES = ((7, 7), (11, 11), (19, 19), (25, 25))
+NUM_SNAKES = (1, 2, 4, 8)
+# Bodies of this mean length and longer are long
+LONG_BODY = 8
+# Boards with this fraction of the cells covered by bodies and longer are crowded
+CROWDED = 0.2
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus.json")
+
+
+class GreedyPlayer(object):
+    """
+    Player chasing the closest food through safe cells, at random once in a while.
+
+    A move is safe when it stays on the board, avoids the bodies and leaves at
+    least as many reachable cells as the body is long. Moves next to the head
+    of a snake at least as long are only taken when nothing else is safe.
+
+    :param seed: Seed of the random moves
+    :type seed: int
+    :param randomness: Probability of a random safe move
+    :type randomness: float
+    """
+    def __init__(self, seed=None, randomness=0.05):
+        self.rng = np.random.default_rng(seed)
+        self.randomness = randomness
+
+    def start(self, data):
+        pass
+
+    def move(self, data):
+        board = data['board']
+        w = board['width']
+        h = board['height']
+        you = data['you']
+        head = you['head']
+        occupied = set()
+        danger = set()
+        for snake in board['snakes']:
+            for pos in snake['body'][:-1]:
+                occupied.add((pos['y'], pos['x']))
+            if snake['id'] != you['id'] and len(snake['body']) >= len(you['body']):
+                for (dy, dx) in sim.DELTAS.values():
+                    danger.add((snake['head']['y'] + dy, snake['head']['x'] + dx))
+        food = [(pos['y'], pos['x']) for pos in board['food']]
+
+        def space(start, limit):
+            # Cells reachable from start, counted up to limit
+            seen = {start}
+            stack = [start]
+            while stack and len(seen) < limit:
+                y, x = stack.pop()
+                for (dy, dx) in sim.DELTAS.values():
+                    cell = (y + dy, x + dx)
+                    if 0 <= cell[0] < h and 0 <= cell[1] < w and cell not in occupied and cell not in seen:
+                        seen.add(cell)
+                        stack.append(cell)
+            return len(seen)
+
+        choices = []
+        for move in sim.MOVES:
+            dy, dx = sim.DELTAS[move]
+            cell = (head['y'] + dy, head['x'] + dx)
+            if not (0 <= cell[0] < h and 0 <= cell[1] < w) or cell in occupied:
+                continue
+            trapped = space(cell, len(you['body'])) < len(you['body'])
+            distance = min([abs(cell[0] - fy) + abs(cell[1] - fx) for (fy, fx) in food], default=0)
+            choices.append((trapped, cell in danger, distance, move))
+        if not choices:
+            return "up"
+        choices.sort()
+        best = [choice for choice in choices if choice[:2] == choices[0][:2]]
+        if self.rng.random() < self.randomness:
+            return best[self.rng.integers(len(best))][3]
+        return best[0][3]
+
+    def end(self, data):
+        pass
+
+
+class RecordingPlayer(GreedyPlayer):
+    """
+    GreedyPlayer which records the payloads it receives.
+    """
+    def __init__(self, seed=None, randomness=0.05, every=3):
+        super().__init__(seed, randomness)
+        self.every = every
+        self.payloads = []
+
+    def move(self, data):
+        if data['turn'] % self.every == 0:
+            # The board is shared by every payload of the turn
+            self.payloads.append(json.loads(json.dumps(data)))
+        return super().move(data)
+
+
+def bucket(data):
+    """
+    Bucket of a payload, e.g. "11x11/2-4 snakes/long/crowded"
+
+    :param data: A /move payload
+    :type data: dict
+    :rtype: str
+    """
+    board = data['board']
+    snakes = board['snakes']
+    n = len(snakes)
+    if n <= 1:
+        count = "1 snake"
+    elif n <= 4:
+        count = "2-4 snakes"
+    else:
+        count = "5-8 snakes"
+    cells = sum(len(snake['body']) for snake in snakes)
+    body = "long" if n and cells / n >= LONG_BODY else "short"
+    layout = "crowded" if cells >= CROWDED * board['width'] * board['height'] else "open"
+    return "{}x{}/{}/{}/{}".format(board['width'], board['height'], count, body, layout)
+
+
+def generate(per_bucket=8, games=6, seed=0):
+    """
+    Play games and keep up to per_bucket payloads of every bucket
+
+    :param per_bucket: The maximum number of payloads of a bucket
+    :type per_bucket: int
+    :param games: Games played for every board size and number of snakes
+    :type games: int
+    :param seed: Seed of the first game
+    :type seed: int
+    :return: [{"bucket", "data"}] sorted by bucket
+    :rtype: list
+    """
+    buckets = {}
+    n = seed
+    for (w, h) in SIZES:
+        for num_snakes in NUM_SNAKES:
+            for _ in range(games):
+                game = sim.Game(w, h, num_snakes, seed=n, game_id="corpus-{}".format(n))
+                players = [RecordingPlayer(seed=n * 10 + i, every=3 + i) for i in range(num_snakes)]
+                game.run(players, max_turns=1000)
+                n += 1
+                for player in players:
+                    for data in player.payloads:
+                        buckets.setdefault(bucket(data), []).append(data)
+
+    corpus = []
+    for name in sorted(buckets):
+        # Spread over the games and turns recorded in the bucket
+        payloads = buckets[name]
+        step = max(len(payloads) / per_bucket, 1)
+        for i in range(min(per_bucket, len(payloads))):
+            corpus.append({"bucket": name, "data": payloads[int(i * step)]})
+    return corpus
+
+
+def digest(corpus):
+    # Fingerprint of the corpus, results of different corpora are not comparable
+    return hashlib.sha1(json.dumps(corpus, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def load(path=DEFAULT_PATH):
+    # The corpus at path, recorded first if the file does not exist
+    if not os.path.isfile(path):
+        save(generate(), path)
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(corpus, path=DEFAULT_PATH):
+    with open(path, 'w') as f:
+        json.dump(corpus, f, separators=(',', ':'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record the benchmark corpus of /move payloads")
+    parser.add_argument("--out", default=DEFAULT_PATH)
+    parser.add_argument("--per-bucket", type=int, default=8)
+    parser.add_argument("--games", type=int, default=6, help="games per board size and number of snakes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = generate(args.per_bucket, args.games, args.seed)
+    save(corpus, args.out)
+    counts = {}
+    for entry in corpus:
+        counts[entry['bucket']] = counts.get(entry['bucket'], 0) + 1
+    for name in sorted(counts):
+        print("{:<40} {}".format(name, counts[name]))
+    print("{} payloads in {} buckets, digest {}, written to {}".format(len(corpus), len(counts), digest(corpus), args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+HTTP load test: concurrent simulated games played against a server.py process.
+
+The server is started on a free local port (or --url targets a running one)
+and every worker thread plays games back to back over HTTP, like the engine:
+/start, one /move per turn and snake, /end. The server plays --server-snakes
+snakes of every game, the others are greedy players in this process. Turns are
+paced to --turn-ms, the time the engine takes for a turn of a real game.
+
+Reports the latency percentiles of every endpoint, the move throughput, the
+moves slower than the timeout budget and the resident memory of the server
+over time.
+
+    python -m benchmark.loadtest --concurrency 20 --duration 60 --out load.json
+"""
+import argparse
+import datetime
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+import Simulator as sim
+from benchmark.corpus import GreedyPlayer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ("start", "move", "end")
+PERCENTILES = (50, 95, 99)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_bytes(pid):
+    # Resident set size of a process, None once it exited
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class ServerProcess(object):
+    """
+    server.py running in a child process on a free local port.
+
+    :param log_path: Where the server output goes, discarded if None
+    :type log_path: str
+    """
+    def __init__(self, log_path=None, startup_timeout=30.0):
+        self.port = free_port()
+        self.url = "http://127.0.0.1:{}".format(self.port)
+        env = dict(os.environ, PORT=str(self.port))
+        self.log = open(log_path, 'w') if log_path else subprocess.DEVNULL
+        self.process = subprocess.Popen(
+            [sys.executable, "server.py"], cwd=ROOT, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        self.pid = self.process.pid
+        deadline = time.monotonic() + startup_timeout
+        while True:
+            try:
+                urllib.request.urlopen(self.url + "/", timeout=1.0).read()
+                return
+            except OSError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError("The server did not start on port {}".format(self.port))
+                time.sleep(0.1)
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.log is not subprocess.DEVNULL:
+            self.log.close()
+
+
+class RssSampler(threading.Thread):
+    """
+    Samples the resident memory of a process every interval seconds.
+    """
+    def __init__(self, pid, interval=1.0):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+        self.started = time.monotonic()
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = rss_bytes(self.pid)
+            if rss is None:
+                break
+            self.samples.append((round(time.monotonic() - self.started, 1), rss))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Recorder(object):
+    """
+    Latencies and failures of the requests, shared by the workers.
+
+    :param budget: Seconds a move may take without breaking the timeout budget
+    :type budget: float
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.errors = {endpoint: 0 for endpoint in ENDPOINTS}
+        self.violations = 0
+        self.games = 0
+        self.turns = 0
+
+    def request(self, url, endpoint, data):
+        # POST one request, returns the decoded response or None on failure
+        body = json.dumps(data).encode()
+        request = urllib.request.Request(
+            url + "/" + endpoint, data=body, headers={"Content-Type": "application/json"})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=10.0) as response:
+                text = response.read()
+        except OSError:
+            with self.lock:
+                self.errors[endpoint] += 1
+            return None
+        seconds = time.perf_counter() - start
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if endpoint == "move" and seconds > self.budget:
+                self.violations += 1
+        return json.loads(text) if endpoint == "move" else text
+
+
+class HttpPlayer(object):
+    """
+    Player whose moves are decided by the server over HTTP.
+    """
+    def __init__(self, url, recorder):
+        self.url = url
+        self.recorder = recorder
+
+    def start(self, data):
+        self.recorder.request(self.url, "start", data)
+
+    def move(self, data):
+        response = self.recorder.request(self.url, "move", data)
+        return response["move"] if response else "up"
+
+    def end(self, data):
+        self.recorder.request(self.url, "end", data)
+
+
+def play(game, players, recorder, turn_seconds, stop_at, max_turns):
+    """
+    Play one game, turns paced to turn_seconds, stopping early at stop_at
+
+    The players of a turn are asked in turn order rather than in parallel, a
+    worker is one game on the wire at a time.
+    """
+    by_id = {snake.id: player for snake, player in zip(game.snakes, players)}
+    for snake in game.snakes:
+        by_id[snake.id].start(game.payload(snake))
+    while not game.is_over() and game.turn < max_turns and time.monotonic() < stop_at:
+        started = time.monotonic()
+        board = game.board_payload()
+        moves = {}
+        for snake in game.alive_snakes():
+            moves[snake.id] = by_id[snake.id].move(game.payload(snake, board))
+        game.step(moves)
+        with recorder.lock:
+            recorder.turns += 1
+        time.sleep(max(0.0, turn_seconds - (time.monotonic() - started)))
+    for snake in game.snakes:
+        by_id[snake.id].end(game.payload(snake))
+    with recorder.lock:
+        recorder.games += 1
+
+
+def worker(n, args, url, recorder, stop_at):
+    # Play games back to back until stop_at
+    http = HttpPlayer(url, recorder)
+    rng = np.random.default_rng(args.seed + n)
+    sizes = [tuple(int(v) for v in size.split("x")) for size in args.sizes]
+    # Spread the starts, games do not all hit the server on the same turn
+    time.sleep(rng.random() * args.turn_ms / 1000.0)
+    game_number = 0
+    while time.monotonic() < stop_at:
+        (w, h) = sizes[rng.integers(len(sizes))]
+        seed = int(rng.integers(1 << 31))
+        game = sim.Game(w, h, args.snakes, seed=seed, timeout=args.timeout,
+                        game_id="load-{}-{}".format(n, game_number))
+        players = [http if i < args.server_snakes else GreedyPlayer(seed + i) for i in range(args.snakes)]
+        play(game, players, recorder, args.turn_ms / 1000.0, stop_at, args.max_turns)
+        game_number += 1
+
+
+def summarize(latencies, seconds):
+    if not latencies:
+        return {"n": 0}
+    ms = np.array(latencies) * 1000
+    summary = {"n": len(latencies), "per_second": round(len(latencies) / seconds, 1),
+               "mean_ms": round(float(ms.mean()), 2)}
+    for p, value in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+        summary["p{}_ms".format(p)] = round(float(value), 2)
+    summary["max_ms"] = round(float(ms.max()), 2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test server.py with concurrent simulated games")
+    parser.add_argument("--url", help="test a running server instead of starting one")
+    parser.add_argument("--pid", type=int, help="process to sample the memory of with --url")
+    parser.add_argument("--concurrency", type=int, default=10, help="games played at the same time")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--sizes", nargs="*", default=["11x11"], help="board sizes, e.g. 7x7 19x19")
+    parser.add_argument("--snakes", type=int, default=4)
+    parser.add_argument("--server-snakes", type=int, default=1, help="snakes of a game played by the server")
+    parser.add_argument("--turn-ms", type=float, default=200.0, help="minimum duration of a turn")
+    parser.add_argument("--max-turns", type=int, default=500)
+    parser.add_argument("--timeout", type=int, default=500, help="game.timeout sent to the server in milliseconds")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="network round trip the engine would add")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--server-log", help="file receiving the output of the server")
+    parser.add_argument("--out", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        url = args.url.rstrip("/")
+        pid = args.pid
+    else:
+        server = ServerProcess(args.server_log)
+        url = server.url
+        pid = server.pid
+
+    # A move answered later than this would miss the engine's timeout
+    recorder = Recorder((args.timeout - args.latency_ms) / 1000.0)
+    sampler = RssSampler(pid) if pid else None
+    if sampler:
+        sampler.start()
+    started = time.monotonic()
+    stop_at = started + args.duration
+    workers = [threading.Thread(target=worker, args=(n, args, url, recorder, stop_at), daemon=True)
+               for n in range(args.concurrency)]
+    try:
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    finally:
+        seconds = time.monotonic() - started
+        if sampler:
+            sampler.stop()
+        if server:
+            server.stop()
+
+    rss = [value for (_, value) in sampler.samples] if sampler else []
+    report = {
+        "meta": {
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "sizes": args.sizes,
+            "snakes": args.snakes,
+            "server_snakes": args.server_snakes,
+            "turn_ms": args.turn_ms,
+            "timeout_ms": args.timeout,
+            "budget_ms": round(recorder.budget * 1000, 1),
+            "seconds": round(seconds, 1),
+        },
+        "games": recorder.games,
+        "turns": recorder.turns,
+        "latency": {endpoint: summarize(recorder.latencies[endpoint], seconds) for endpoint in ENDPOINTS},
+        "errors": recorder.errors,
+        "budget_violations": recorder.violations,
+        "rss": {
+            "start_mb": round(rss[0] / 2**20, 1) if rss else None,
+            "max_mb": round(max(rss) / 2**20, 1) if rss else None,
+            "end_mb": round(rss[-1] / 2**20, 1) if rss else None,
+            "samples": sampler.samples if sampler else [],
+        },
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    print("{} games, {} turns in {:.1f} s with {} concurrent games".format(
+        recorder.games, recorder.turns, seconds, args.concurrency))
+    for endpoint in ENDPOINTS:
+        summary = report["latency"][endpoint]
+        if summary["n"]:
+            print("/{:<6} {:>7} requests {:>7.1f}/s  p50 {:>7.1f} ms  p95 {:>7.1f} ms  p99 {:>7.1f} ms  max {:>7.1f} ms  errors {}".format(
+                endpoint, summary["n"], summary["per_second"], summary["p50_ms"], summary["p95_ms"],
+                summary["p99_ms"], summary["max_ms"], recorder.errors[endpoint]))
+    print("Moves over the {:.0f} ms budget: {}".format(recorder.budget * 1000, recorder.violations))
+    if rss:
+        print("Server RSS: {start_mb} MB at start, {max_mb} MB at most, {end_mb} MB at the end".format(**report["rss"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Run the benchmarks over the corpus, write the results as JSON and compare them with a baseline.
+
+Every case is timed call by call over every payload of the corpus, repeat
+times, with the garbage collector paused. Latencies are summarized overall
+and per board size. With a baseline, a case whose overall p99 grew by more
+than the threshold (and by more than min-delta-us) is a regression and the
+run exits with status 1.
+
+    python -m benchmark.run --out before.json
+    python -m benchmark.run --out after.json --baseline before.json --threshold 0.1
+"""
+import argparse
+import datetime
+import gc
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+import eventlog
+from benchmark import cases as bc
+from benchmark import corpus as bcorpus
+
+PERCENTILES = (50, 90, 99)
+
+
+def summarize(samples):
+    """
+    Latency summary of the samples in microseconds
+
+    :param samples: Seconds of every call
+    :type samples: list
+    :rtype: dict
+    """
+    us = np.array(samples) * 1e6
+    summary = {"n": len(samples), "mean_us": round(float(us.mean()), 2)}
+    for p, value in zip(PERCENTILES, np.percentile(us, PERCENTILES)):
+        summary["p{}_us".format(p)] = round(float(value), 2)
+    summary["max_us"] = round(float(us.max()), 2)
+    return summary
+
+
+def run_case(setup, call, samples, repeat):
+    """
+    Time one case over the samples
+
+    :return: {size: [seconds]}, "all" included
+    :rtype: dict
+    """
+    timings = {"all": []}
+    # Warm up caches and lazily built tables
+    for sample in samples[:3]:
+        call(*setup(sample))
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for sample in samples:
+                args = setup(sample)
+                start = time.perf_counter()
+                call(*args)
+                seconds = time.perf_counter() - start
+                timings["all"].append(seconds)
+                timings.setdefault(sample.size, []).append(seconds)
+    finally:
+        gc.enable()
+    return timings
+
+
+def compare(results, baseline, threshold, min_delta_us):
+    """
+    Cases whose overall p99 got worse than the baseline
+
+    :return: [(case, baseline p99, p99)]
+    :rtype: list
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["all"]["p99_us"]
+        after = result["all"]["p99_us"]
+        if after > before * (1 + threshold) and after - before > min_delta_us:
+            regressions.append((name, before, after))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the move path over the corpus")
+    parser.add_argument("--corpus", default=bcorpus.DEFAULT_PATH, help="recorded first if missing")
+    parser.add_argument("--config", default="learner.json")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results JSON to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative growth of p99")
+    parser.add_argument("--min-delta-us", type=float, default=2.0, help="smaller growth of p99 is noise")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cases", nargs="*", help="only the cases containing one of these")
+    args = parser.parse_args()
+
+    corpus = bcorpus.load(args.corpus)
+    samples = [bc.Sample(entry) for entry in corpus]
+    with open(args.config) as f:
+        raw_config = json.load(f)
+
+    results = {}
+    for name, setup, call in bc.build(raw_config):
+        if args.cases and not any(pattern in name for pattern in args.cases):
+            continue
+        timings = run_case(setup, call, samples, args.repeat)
+        results[name] = {size: summarize(seconds) for size, seconds in sorted(timings.items())}
+        summary = results[name]["all"]
+        print("{:<34} mean {:>10.1f} us  p50 {:>10.1f} us  p99 {:>10.1f} us".format(
+            name, summary["mean_us"], summary["p50_us"], summary["p99_us"]))
+    eventlog.stop()
+
+    report = {
+        "meta": {
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "corpus": bcorpus.digest(corpus),
+            "payloads": len(corpus),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"]["corpus"] != report["meta"]["corpus"]:
+            print("The baseline was measured on another corpus ({}), not comparing".format(baseline["meta"]["corpus"]))
+            sys.exit(2)
+        regressions = compare(results, baseline["results"], args.threshold, args.min_delta_us)
+        for name, before, after in regressions:
+            print("REGRESSION {}: p99 {:.1f} us -> {:.1f} us (+{:.0f}%)".format(name, before, after, (after / before - 1) * 100))
+        if regressions:
+            sys.exit(1)
+        print("OK: no p99 regression above {:.0f}%".format(args.threshold * 100))
+
+
+if __name__ == "__main__":
+    main()
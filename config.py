@@ -7,6 +7,10 @@ class LearnerConfig(object):
         self.rar = config.get('rar', 0.5)
         self.radr = config.get('radr', 0.999)
         self.dyna = config.get('dyna', 0)
+        self.dyna_mode = config.get('dyna_mode', 'batch')
+        self.replay_capacity = config.get('replay_capacity', 100000)
+        self.replay_eviction = config.get('replay_eviction', 'fifo')
+        self.lock_stripes = config.get('lock_stripes', 64)
         self.verbose = config.get('verbose', False)
         self.Q = config.get('Q', None)
 
@@ -19,6 +23,9 @@ class RuntimeConfig(object):
         self.health_threshold_decay = config.get('health_threshold_decay', 0.9)
         self.is_food_strategy_threshold = config.get('is_food_strategy_threshold', 2)
         self.dump_at_end = config.get('dump_at_end', False)
+        self.network_margin_ms = config.get('network_margin_ms', 100)
+        # Decides the moves the head strategy leaves: 'default' (food or learner), 'voronoi' or 'search'
+        self.strategy = config.get('strategy', 'default')
 
 
 class RewardConfig(object):
@@ -28,3 +35,66 @@ class RewardConfig(object):
         self.low_health = config.get('low_health', -10.0)
         self.die = config.get('die', -10000.0)
         self.eat_food = config.get('eat_food', 100.0)
+
+
+class PersistenceConfig(object):
+    def __init__(self, config):
+        q = config.get('Q', None) or 'qtable.json'
+        config = config['persistence'] if 'persistence' in config else {}
+        self.enabled = config.get('enabled', False)
+        self.snapshot = config.get('snapshot', q)
+        self.journal = config.get('journal', self.snapshot + '.journal')
+        self.interval = config.get('interval', 60.0)
+        self.flush_interval = config.get('flush_interval', 1.0)
+
+
+class SessionConfig(object):
+    def __init__(self, config):
+        config = config['runtime'] if 'runtime' in config else {}
+        config = config['sessions'] if 'sessions' in config else {}
+        self.ttl = config.get('ttl', 600.0)
+        self.max_sessions = config.get('max_sessions', 10000)
+
+
+class WorkersConfig(object):
+    def __init__(self, config):
+        config = config['runtime'] if 'runtime' in config else {}
+        config = config['workers'] if 'workers' in config else {}
+        # Server processes sharing the listening socket, 1 serves in-process, 0 starts one per core
+        self.processes = config.get('processes', 1)
+        # 'socket': the workers accept from the listening socket, 'affinity': a dispatcher process
+        # forwards all the requests of a game to the same worker
+        self.dispatch = config.get('dispatch', 'socket')
+        # Slots of the shared Q table, twice num_states by default
+        self.capacity = config.get('capacity', None)
+        # Experiences waiting for the writer process before new ones are dropped
+        self.queue_size = config.get('queue_size', 10000)
+
+
+class LoggingConfig(object):
+    def __init__(self, config):
+        config = config['logging'] if 'logging' in config else {}
+        self.level = config.get('level', 'info')
+        self.sample_rate = config.get('sample_rate', 1.0)
+        self.capacity = config.get('capacity', 10000)
+
+
+class VoronoiConfig(object):
+    def __init__(self, config):
+        config = config['voronoi'] if 'voronoi' in config else {}
+        self.food_weight = config.get('food_weight', 1.0)
+        self.hungry_health = config.get('hungry_health', 30)
+        self.hungry_food_weight = config.get('hungry_food_weight', 10.0)
+
+
+class SearchConfig(object):
+    def __init__(self, config):
+        config = config['search'] if 'search' in config else {}
+        self.max_depth = config.get('max_depth', 12)
+        # Opponents moving in the search, the nearest first
+        self.max_opponents = config.get('max_opponents', 2)
+        self.area_cap = config.get('area_cap', 60)
+        self.length_weight = config.get('length_weight', 2.0)
+        self.hungry_health = config.get('hungry_health', 30)
+        # Check the moves of the learner and replace the ones the search proves losing
+        self.fallback = config.get('fallback', False)
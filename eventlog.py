@@ -0,0 +1,171 @@
+"""
+Structured event log written off the request path.
+
+Request threads only filter a record by level and sampling and push it into a
+bounded queue, they never block nor write. A background thread drains the
+queue and writes batches of JSON lines to stdout. When the queue is full,
+records are dropped and counted.
+
+    eventlog.info("move", game=game_id, turn=turn, move="up")
+"""
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+LEVELS = {
+    "debug": 10,
+    "info": 20,
+    "warning": 30,
+    "error": 40,
+}
+
+
+class EventLog(object):
+    """
+    :param level: Name of the lowest level written
+    :type level: str
+    :param sample_rate: Fraction of the records below warning which are kept
+    :type sample_rate: float
+    :param capacity: The maximum number of records waiting to be written
+    :type capacity: int
+    :param batch_size: The maximum number of records written at once
+    :type batch_size: int
+    :param flush_interval: Seconds the writer waits for records
+    :type flush_interval: float
+    """
+    def __init__(self, level="info", sample_rate=1.0, capacity=10000, batch_size=256, flush_interval=0.5):
+        self.level = LEVELS[level]
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(capacity)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.written = 0
+        self.dropped = 0
+        self.sampled = 0
+
+    def log(self, level, event, **fields):
+        level_no = LEVELS[level]
+        if level_no < self.level:
+            return
+        # Warnings and errors are never sampled out
+        if self.sample_rate < 1.0 and level_no < LEVELS["warning"] and random.random() >= self.sample_rate:
+            self.sampled += 1
+            return
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait((time.time(), level, event, fields))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.stopped.clear()
+                self.thread = threading.Thread(target=self.__run, name="eventlog", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        # Write everything queued so far
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread is not None:
+            self.stopped.set()
+            thread.join()
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "sampled": self.sampled,
+        }
+
+    def __run(self):
+        while True:
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self.__write(batch)
+            elif self.stopped.is_set():
+                return
+
+    def __write(self, batch):
+        lines = []
+        for ts, level, event, fields in batch:
+            record = {"ts": round(ts, 3), "level": level, "event": event}
+            record.update(fields)
+            lines.append(json.dumps(record, separators=(',', ':'), default=str))
+        # Looked up on every write so redirections of stdout are honoured
+        out = sys.stdout
+        out.write("\n".join(lines) + "\n")
+        out.flush()
+        self.written += len(batch)
+
+
+_log = EventLog()
+
+
+def _after_fork():
+    # Only the forking thread survives in a child process, which starts over with its own writer
+    global _log
+    level = _log.level
+    sample_rate = _log.sample_rate
+    _log = EventLog(capacity=_log.queue.maxsize)
+    _log.level = level
+    _log.sample_rate = sample_rate
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def configure(logging_config):
+    """
+    Apply the logging section of learner.json, records already queued are kept
+
+    :param logging_config: The logging settings
+    :type logging_config: config.LoggingConfig
+    """
+    global _log
+    if logging_config.capacity != _log.queue.maxsize:
+        _log.stop()
+        _log = EventLog(capacity=logging_config.capacity)
+    _log.level = LEVELS[logging_config.level]
+    _log.sample_rate = logging_config.sample_rate
+
+
+def debug(event, **fields):
+    _log.log("debug", event, **fields)
+
+
+def info(event, **fields):
+    _log.log("info", event, **fields)
+
+
+def warning(event, **fields):
+    _log.log("warning", event, **fields)
+
+
+def error(event, **fields):
+    _log.log("error", event, **fields)
+
+
+def stop():
+    _log.stop()
+
+
+def stats():
+    return _log.stats()
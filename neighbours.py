@@ -0,0 +1,74 @@
+"""
+Neighbour tables of the board sizes, built once per (width, height).
+
+Cells are linear indices y * w + x. Row c of a table holds the cells next to
+c toward ["up", "down", "left", "right"], OFF_BOARD for the moves leaving the
+board, so traversals never check the boundaries themselves.
+
+    nears = neighbours.table(w, h).rows
+    for a, nc in enumerate(nears[c]):
+        if nc != neighbours.OFF_BOARD and free[nc]:
+            ...
+"""
+import numpy as np
+
+# Direction codes, same order as ["up", "down", "left", "right"]
+UP = 0
+DOWN = 1
+LEFT = 2
+RIGHT = 3
+# (dy, dx) of every direction
+DELTAS = ((1, 0), (-1, 0), (0, -1), (0, 1))
+OFF_BOARD = -1
+# Standard board sizes, built when the server starts
+COMMON_SIZES = ((7, 7), (11, 11), (19, 19), (25, 25))
+
+
+class NeighbourTable(object):
+    """
+    :param w: Width of the board
+    :type w: int
+    :param h: Height of the board
+    :type h: int
+    """
+    def __init__(self, w, h):
+        self.w = w
+        self.h = h
+        cells = np.arange(w * h, dtype=np.int32)
+        ys, xs = np.divmod(cells, w)
+        array = np.full((w * h, 4), OFF_BOARD, dtype=np.int32)
+        array[:, UP] = np.where(ys + 1 < h, cells + w, OFF_BOARD)
+        array[:, DOWN] = np.where(ys > 0, cells - w, OFF_BOARD)
+        array[:, LEFT] = np.where(xs > 0, cells - 1, OFF_BOARD)
+        array[:, RIGHT] = np.where(xs + 1 < w, cells + 1, OFF_BOARD)
+        # (cells, 4) int32 array, for vectorized code
+        self.array = array
+        # Same table as tuples, indexing them from Python is much faster than indexing the array
+        self.rows = tuple(map(tuple, array.tolist()))
+
+    def around(self, y, x):
+        # Neighbours of (y, x), also for a cell off the board such as the head of a dead snake
+        if 0 <= y < self.h and 0 <= x < self.w:
+            return self.rows[y * self.w + x]
+        nears = []
+        for (dy, dx) in DELTAS:
+            ny, nx = y + dy, x + dx
+            nears.append(ny * self.w + nx if 0 <= ny < self.h and 0 <= nx < self.w else OFF_BOARD)
+        return tuple(nears)
+
+
+_tables = {}
+
+
+def table(w, h):
+    nears = _tables.get((w, h))
+    if nears is None:
+        nears = NeighbourTable(w, h)
+        _tables[(w, h)] = nears
+    return nears
+
+
+def warm(sizes=COMMON_SIZES):
+    # Build the tables before the first game needs them
+    for (w, h) in sizes:
+        table(w, h)
@@ -1,27 +1,66 @@
 import os
 import json
+import time
 import cherrypy
+from cherrypy.lib import jsontools
 
 import config as cf
+import eventlog
 import QLearnerStrategy as qs
 import FoodStrategy as fs
 import HeadStrategy as hs
+import VoronoiStrategy as vs
+import SearchStrategy as ss
+import neighbours
 import util
+from Metrics import Metrics
+from SessionStore import SessionStore, CHECKPOINT_HEADER
+from TurnContext import TurnContext, DeadlineExpired
+
+def timed_json_processor(entity):
+    # Same as the default JSON processor, also records the decode time
+    start = time.perf_counter()
+    jsontools.json_processor(entity)
+    cherrypy.serving.request.json_seconds = time.perf_counter() - start
+
 
 """
 This is a simple Battlesnake server written in Python.
 For instructions see https://github.com/BattlesnakeOfficial/starter-snake-python/README.md
 """
 class Battlesnake(object):
-    def __init__(self):
-        # Load learner parameters from learner.json
-        with open('learner.json') as f:
-            self.raw_config = json.load(f)
+    def __init__(self, raw_config=None, table=None, updates=None):
+        # table and updates are given to the worker processes sharing one Q table, see workers.py
+        # Load learner parameters from learner.json unless given
+        if raw_config is None:
+            with open('learner.json') as f:
+                raw_config = json.load(f)
+        self.raw_config = raw_config
+        eventlog.configure(cf.LoggingConfig(self.raw_config))
+        # No game pays for building the neighbour tables of the standard sizes
+        neighbours.warm()
 
         self.runtime_config = cf.RuntimeConfig(self.raw_config)
-        self.qlearnerStrategy = qs.QLearnerStrategy(self.raw_config)
+        self.num_actions = cf.LearnerConfig(self.raw_config).num_actions
+        session_config = cf.SessionConfig(self.raw_config)
+        self.sessions = SessionStore(session_config.ttl, session_config.max_sessions)
+        self.stage_metrics = Metrics()
+        self.stage_metrics.gauge("battlesnake_sessions", "Game sessions in memory.", lambda: len(self.sessions))
+        self.stage_metrics.gauge("battlesnake_session_bytes", "Estimated bytes held by the game sessions.", self.sessions.nbytes)
+        self.stage_metrics.gauge("battlesnake_sessions_expired", "Game sessions removed after their TTL.", lambda: self.sessions.expired)
+        self.stage_metrics.gauge("battlesnake_sessions_evicted", "Game sessions evicted over max_sessions.", lambda: self.sessions.evicted)
+        self.stage_metrics.gauge("battlesnake_log_dropped", "Log records dropped while the log queue was full.", lambda: eventlog.stats()["dropped"])
+        self.qlearnerStrategy = qs.QLearnerStrategy(self.raw_config, table, updates)
+        if table is not None:
+            self.stage_metrics.gauge("battlesnake_qtable_rows", "Rows of the shared Q table.", lambda: len(table))
+        if hasattr(self.qlearnerStrategy.learner.Q, 'nbytes'):
+            self.stage_metrics.gauge("battlesnake_qtable_bytes", "Estimated bytes held by the Q table.", self.qlearnerStrategy.learner.Q.nbytes)
         self.foodStrategy = fs.FoodStrategy(self.raw_config)
         self.headStrategy = hs.HeadStrategy(self.raw_config)
+        self.voronoiStrategy = vs.VoronoiStrategy(self.raw_config)
+        self.searchStrategy = ss.SearchStrategy(self.raw_config)
+        self.stage_metrics.gauge("battlesnake_search_depth", "Depth completed by the last search.", lambda: self.searchStrategy.last_depth)
+        self.stage_metrics.gauge("battlesnake_search_nodes_per_second", "Nodes searched per second by the last search.", lambda: self.searchStrategy.last_nodes_per_second)
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
@@ -43,85 +82,168 @@ class Battlesnake(object):
         # This function is called everytime your snake is entered into a game.
         # cherrypy.request.json contains information about the game that's about to be played.
         data = cherrypy.request.json
-
-        self.qlearnerStrategy.start(data)
-        self.foodStrategy.start(data)
-
-        print("START")
+        result = self.handle_start(data)
+        self.checkpoint_session(data)
+        return result
+
+    def handle_start(self, data):
+        session = self.sessions.start(data)
+        self.qlearnerStrategy.start(data, session)
+        self.foodStrategy.start(data, session)
+        self.voronoiStrategy.start(data, session)
+        self.searchStrategy.start(data, session)
+
+        eventlog.info("start", game=session.id, width=data['board']['width'], height=data['board']['height'])
         return "ok"
 
     @cherrypy.expose
-    @cherrypy.tools.json_in()
+    @cherrypy.tools.json_in(processor=timed_json_processor)
     @cherrypy.tools.json_out()
     def move(self):
         # This function is called on every turn of a game. It's how your snake decides where to move.
         # Valid moves are "up", "down", "left", or "right".
         data = cherrypy.request.json
+        self.restore_session(data)
+        result = self.handle_move(data, {"json_decode": cherrypy.request.json_seconds})
+        self.checkpoint_session(data)
+        return result
 
-        # calculate routes
-        board = data['board']
-        h = board['height']
-        w = board['width']
-        you = data['you']
-        head = you['head']
-        states = util.construct_borad(data)
-        routes = [-1, -1, -1, -1]
+    def handle_move(self, data, timings=None):
+        start = time.perf_counter()
+        # The move must be decided before the engine's timeout minus the network round trip
+        timeout = data['game'].get('timeout', 500)
+        deadline = time.monotonic() + (timeout - self.runtime_config.network_margin_ms) / 1000.0
 
-        block_arr = util.determine_block_array(data, states, len(routes))
+        # Board analysis shared by all strategies, computed lazily
+        ctx = TurnContext(data, self.num_actions, self.sessions.get(data), deadline, timings)
 
-        for a in range(len(routes)):
-            if not block_arr[a]:
-                possible_routes = util.calculate_possible_routes(head['y'], head['x'], a, w, h, states)
-                routes[a] = possible_routes
-
-        data['states'] = states
-        data['block_arr'] = block_arr
-        data['routes'] = routes
+        # Each stage refines the move of the previous one, the best move so far is returned at the deadline
+        mode = "SAFE"
+        move = self.safe_move(ctx)
+        ctx.stage = mode
 
         # HeadStrategy first
-        move = self.headStrategy.move(data)
-        if move is None:
-            def is_food_strategy_mode():
-                board = data['board']
-                my_id = data['you']['id']
-                max_other_length = 0
-                if 'snakes' in board:
-                    for snake in board['snakes']:
-                        if not snake['id'] == my_id:
-                            max_other_length = max(max_other_length, len(snake['body']))
-                return len(data['you']['body']) < max_other_length + self.runtime_config.is_food_strategy_threshold
-
-            if is_food_strategy_mode():
-                mode = "FOOD"
-                move = self.foodStrategy.move(data)
-            else:
-                mode = "LEARN"
-                move = self.qlearnerStrategy.move(data)
-        else:
-            mode = "HEAD"
-
-        print(f"THIS TURN({data['turn']}) <{mode}> MOVE({move})")
+        try:
+            if not ctx.expired():
+                head_move = self.headStrategy.move(data, ctx)
+                ctx.stage = "HEAD"
+                if head_move is not None:
+                    mode = "HEAD"
+                    move = head_move
+                elif not ctx.expired():
+                    # The mode is set once its stage decided, a route search may hit the deadline
+                    if self.runtime_config.strategy == 'voronoi':
+                        # None when every direction is blocked
+                        move = self.voronoiStrategy.move(data, ctx) or move
+                        mode = "VORONOI"
+                    elif self.runtime_config.strategy == 'search':
+                        # None when no depth was searched before the deadline
+                        move = self.searchStrategy.move(data, ctx) or move
+                        mode = "SEARCH"
+                    elif self.is_food_strategy_mode(ctx.game):
+                        with ctx.timed('food'):
+                            move = self.foodStrategy.move(data, ctx)
+                        mode = "FOOD"
+                    else:
+                        move = self.qlearnerStrategy.move(data, ctx)
+                        mode = "LEARN"
+                        if self.searchStrategy.config.fallback and not ctx.expired():
+                            search_move = self.searchStrategy.override(data, ctx, move)
+                            if search_move is not None:
+                                mode = "SEARCH"
+                                move = search_move
+                    ctx.stage = mode
+        except DeadlineExpired:
+            # The best move so far is returned
+            pass
+
+        if (mode == "SAFE" and self.qlearnerStrategy.is_learning_mode and self.runtime_config.strategy == 'default'
+                and not self.is_food_strategy_mode(ctx.game)):
+            # The deadline came before the learner, which starts over next turn instead of
+            # crediting its next update to the action of an older turn
+            self.qlearnerStrategy.skip(ctx.session)
+
+        # Whole request, the other stages exclude each other
+        ctx.timings['move'] = time.perf_counter() - start
+        self.stage_metrics.observe(ctx.timings, "{}x{}".format(ctx.w, ctx.h), mode)
+        eventlog.info("move", game=ctx.session.id, turn=ctx.game.turn, mode=mode, move=move, stage=ctx.stage,
+                      ms=round(ctx.timings['move'] * 1000, 3), left_ms=round(ctx.time_left() * 1000, 1))
 
         return {"move": move}
 
+    def restore_session(self, data):
+        # Behind the dispatcher the checkpoint of the previous turn comes with the request, so
+        # any worker continues the game, also after a restart
+        checkpoint = cherrypy.request.headers.get(CHECKPOINT_HEADER)
+        if checkpoint:
+            checkpoint = json.loads(checkpoint)
+            if checkpoint is not None:
+                self.qlearnerStrategy.restore(self.sessions.get(data), checkpoint)
+
+    def checkpoint_session(self, data):
+        # Send the checkpoint of the session back to the dispatcher, which keeps it for the next turn
+        if CHECKPOINT_HEADER in cherrypy.request.headers:
+            checkpoint = self.qlearnerStrategy.checkpoint(self.sessions.get(data))
+            cherrypy.response.headers[CHECKPOINT_HEADER] = json.dumps(checkpoint, separators=(',', ':'))
+
+    def safe_move(self, ctx):
+        # Cheap fallback, the first direction without an immediate block
+        possible_moves = ["up", "down", "left", "right"]
+        for a in range(self.num_actions):
+            if not ctx.block_arr[a]:
+                return possible_moves[a]
+        return possible_moves[0]
+
+    def is_food_strategy_mode(self, game):
+        max_other_length = 0
+        for snake in game.others():
+            max_other_length = max(max_other_length, len(snake.body))
+        return len(game.you.body) < max_other_length + self.runtime_config.is_food_strategy_threshold
+
     @cherrypy.expose
     @cherrypy.tools.json_in()
     def end(self):
         # This function is called when a game your snake was in ends.
         # It's purely for informational purposes, you don't have to make any decisions here.
         data = cherrypy.request.json
+        self.restore_session(data)
+        return self.handle_end(data)
+
+    def handle_end(self, data):
+        # The session is gone after the end, whatever the strategies do with it
+        session = self.sessions.end(data)
+        self.qlearnerStrategy.end(data, session)
+        self.foodStrategy.end(data, session)
+        self.voronoiStrategy.end(data, session)
+        self.searchStrategy.end(data, session)
+
+        eventlog.info("end", game=util.unique_id(data), turn=data['turn'])
+        return "ok"
 
-        # self.qlearnerStrategy.end(data)
-        self.foodStrategy.end(data)
+    @cherrypy.expose
+    def metrics(self):
+        # Latency histograms in the Prometheus text format
+        cherrypy.response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        return self.stage_metrics.render()
 
-        print("END")
-        return "ok"
+    def stop(self):
+        self.qlearnerStrategy.stop()
+        eventlog.stop()
 
 if __name__ == "__main__":
-    server = Battlesnake()
-    cherrypy.config.update({"server.socket_host": "0.0.0.0"})
-    cherrypy.config.update(
-        {"server.socket_port": int(os.environ.get("PORT", "8080")),}
-    )
-    print("Starting Battlesnake Server...")
-    cherrypy.quickstart(server)
+    with open('learner.json') as f:
+        raw_config = json.load(f)
+    port = int(os.environ.get("PORT", "8080"))
+    if cf.WorkersConfig(raw_config).processes != 1:
+        import workers
+        print("Starting Battlesnake Server workers...")
+        workers.serve(raw_config, "0.0.0.0", port)
+    else:
+        server = Battlesnake(raw_config)
+        cherrypy.engine.subscribe('stop', server.stop)
+        cherrypy.config.update({"server.socket_host": "0.0.0.0"})
+        cherrypy.config.update(
+            {"server.socket_port": port,}
+        )
+        print("Starting Battlesnake Server...")
+        cherrypy.quickstart(server)
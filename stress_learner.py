@@ -0,0 +1,152 @@
+"""
+Stress test of the learner shared by concurrent games.
+
+First, many threads hammer a few shared states with updates which count:
+with alpha = gamma = 1, one action and the same state before and after,
+every update adds the reward to Q[s], so any lost update shows up in the sum
+of the table. The i-th update of every thread goes to state i % states, so
+all the threads write the same states at the same time. Then self-play games
+run concurrently through one learning server for every thread count,
+reporting the throughput.
+
+The exit status is 1 when an update is lost, except with --unsafe where
+losses are expected. Throughput is reported, not checked: the games and
+the updates are Python code holding the GIL, so the stripe locks keep the
+games from waiting on each other's table updates but more threads do not
+give more turns per second.
+
+    python stress_learner.py --threads 1 2 4 8
+    python stress_learner.py --unsafe   # without locks, lost updates are expected
+"""
+import argparse
+import contextlib
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+import QLearner as ql
+import eventlog
+import Simulator as sim
+from SessionStore import Session
+
+
+def count_updates(num_threads, updates, num_states, stripes, unsafe=False):
+    """
+    Run concurrent counting updates and compare the table with the expected counts
+
+    :return: (expected, counted, seconds)
+    :rtype: tuple
+    """
+    learner = ql.QLearner(num_states=num_states, num_actions=1, alpha=1.0, gamma=1.0, rar=0.0, lock_stripes=stripes)
+    if unsafe:
+        learner.locks = [contextlib.nullcontext() for _ in learner.locks]
+    block_arr = np.zeros(1, dtype=bool)
+    barrier = threading.Barrier(num_threads)
+
+    def worker(n):
+        session = Session("stress-{}".format(n), 0.0)
+        barrier.wait()
+        for i in range(updates):
+            # Every thread walks the same states in the same order, so the threads keep colliding
+            state = i % num_states
+            learner.querysetstate(state, block_arr, session)
+            learner.query(state, 1.0, block_arr, session)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(num_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    # Every state starts at -1.0
+    counted = sum(learner.Q.get(s, 0) + 1.0 for s in range(num_states))
+    return num_threads * updates, int(round(counted)), elapsed
+
+
+def play_games(num_threads, games, width, height, num_snakes, dyna):
+    """
+    Play games concurrently through one learning server
+
+    :return: (games, turns, seconds, sessions left)
+    :rtype: tuple
+    """
+    import server
+    battlesnake = server.Battlesnake({"num_states": 320000, "rar": 0.2, "dyna": dyna, "Q": None, "runtime": {"is_learning_mode": True}})
+    player = sim.ServerPlayer(battlesnake)
+    turns = [0] * num_threads
+
+    def worker(n):
+        for g in range(games):
+            seed = n * games + g
+            game = sim.Game(width, height, num_snakes, seed=seed, game_id="stress-{}".format(seed))
+            game.run([player] * num_snakes)
+            turns[n] += game.turn
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(num_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return num_threads * games, sum(turns), elapsed, len(battlesnake.sessions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress the learner with concurrent games")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--updates", type=int, default=20000, help="counting updates per thread")
+    parser.add_argument("--states", type=int, default=4, help="states shared by the counting threads")
+    parser.add_argument("--stripes", type=int, default=64)
+    parser.add_argument("--games", type=int, default=5, help="games per thread")
+    parser.add_argument("--width", type=int, default=11)
+    parser.add_argument("--height", type=int, default=11)
+    parser.add_argument("--snakes", type=int, default=4)
+    parser.add_argument("--dyna", type=int, default=20)
+    parser.add_argument("--unsafe", action="store_true", help="replace the stripe locks with no-ops")
+    args = parser.parse_args()
+
+    # Switch threads as often as possible to expose races
+    sys.setswitchinterval(1e-6)
+    out = sys.stdout
+
+    lost = 0
+    for n in args.threads:
+        expected, counted, elapsed = count_updates(n, args.updates, args.states, args.stripes, args.unsafe)
+        lost += expected - counted
+        print("{:>3} threads: {} updates, {} counted, {} lost, {:.0f} updates/s".format(
+            n, expected, counted, expected - counted, expected / elapsed), file=out)
+
+    sys.setswitchinterval(0.005)
+    base = None
+    # --games 0 only runs the counting updates
+    for n in args.threads if args.games else []:
+        # The server logs every turn
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            games, turns, elapsed, sessions = play_games(n, args.games, args.width, args.height, args.snakes, args.dyna)
+        finally:
+            # Drain the event log into the null stream before restoring stdout
+            eventlog.stop()
+            sys.stdout.close()
+            sys.stdout = out
+        base = base if base is not None else turns / elapsed
+        print("{:>3} threads: {} games, {} turns, {:.0f} turns/s ({:.2f}x), {} sessions left".format(
+            n, games, turns, turns / elapsed, turns / elapsed / base, sessions))
+
+    if args.unsafe:
+        print("Without locks: {} updates lost".format(lost))
+    elif lost:
+        print("FAILED: {} updates lost".format(lost))
+        sys.exit(1)
+    else:
+        print("OK: no updates lost")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import Simulator as sim
+import util
+from Bitboard import Bitboard
+from BoardCache import BoardCache
+from GameState import GameState
+
+
+def play(seed, w, h, num_snakes, skip_every=None):
+    # Every turn of a simulated game as seen by each snake, compared with a full rebuild
+    game = sim.Game(w, h, num_snakes, seed=seed, game_id="cache-{}".format(seed))
+    players = [sim.RandomPlayer(seed * num_snakes + i) for i in range(num_snakes)]
+    caches = {snake.id: BoardCache() for snake in game.snakes}
+    checked = 0
+    while not game.is_over() and game.turn < 300:
+        board = game.board_payload()
+        moves = {}
+        for i, snake in enumerate(game.snakes):
+            if not snake.alive:
+                continue
+            data = game.payload(snake, board)
+            moves[snake.id] = players[i].move(data)
+            if skip_every and (game.turn + i) % skip_every == 0:
+                # A missed turn, the next update rebuilds the board
+                continue
+            state = GameState.from_data(data)
+            cache = caches[snake.id]
+            states = cache.update(state)
+            assert (states == util.construct_board(state)).all()
+            assert not states.flags.writeable
+            assert cache.bitboard().bodies == Bitboard.from_state(state).bodies
+            checked += 1
+        game.step(moves)
+    return caches, checked
+
+
+def test_incremental_board_equals_rebuild():
+    for seed in range(4):
+        caches, checked = play(seed, 11, 11, 4)
+        assert checked > 0
+        assert sum(cache.updates for cache in caches.values()) > sum(cache.rebuilds for cache in caches.values())
+
+
+def test_missed_turns_rebuild():
+    for seed in range(2):
+        caches, _ = play(seed, 7, 7, 2, skip_every=7)
+        assert sum(cache.rebuilds for cache in caches.values()) > 2
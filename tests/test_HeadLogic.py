@@ -0,0 +1,21 @@
+import HeadStrategy as hs
+from TurnContext import TurnContext
+
+
+def snake(id, body):
+    body = [{'x': x, 'y': y} for (y, x) in body]
+    return {'id': id, 'name': id, 'health': 90, 'body': body, 'head': body[0], 'length': len(body),
+            'latency': '0', 'shout': ''}
+
+
+def test_dodges_a_contested_cell_holding_a_tail():
+    # The longer opponent up right of my head can move up of my head, where the tail of
+    # a third snake is now: up is contested, the dodge is left
+    me = snake('me', [(5, 5), (4, 5), (3, 5)])
+    opponent = snake('opponent', [(6, 6), (7, 6), (8, 6), (9, 6), (10, 6)])
+    third = snake('third', [(8, 4), (7, 4), (7, 5), (6, 5)])
+    data = {'game': {'id': 'head', 'timeout': 500}, 'turn': 10,
+            'board': {'height': 11, 'width': 11, 'food': [], 'hazards': [], 'snakes': [me, opponent, third]},
+            'you': me}
+    ctx = TurnContext(data, 4)
+    assert hs.HeadStrategy({}).move(data, ctx) == "left"
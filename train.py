@@ -0,0 +1,171 @@
+"""
+Parallel self-play training of the Q table.
+
+Every round, each worker process loads the current table, plays its share of
+self-play games with its own QLearner and sends back the rows it updated
+together with how many times each action was updated. The coordinator merges
+the deltas and broadcasts the merged table with the next round.
+
+Merge rule: for every (state, action) updated in the round, the merged value
+is the visit-weighted average of the workers' values,
+    Q[s, a] = sum_i(n_i * Q_i[s, a]) / sum_i(n_i)
+Actions no worker updated keep the value of the broadcast table.
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+import Simulator as sim
+import util
+from QTable import QTableMap, write_binary, BINARY_EXTENSION
+
+
+class CountingQTable(QTableMap):
+    """
+    QTableMap which also counts the updates of every (state, action).
+    """
+    def __init__(self, num_states, num_actions):
+        super().__init__(num_states, num_actions)
+        self.visits = {}
+
+    def update(self, state, action, val):
+        super().update(state, action, val)
+        state = str(state)
+        if state not in self.visits:
+            self.visits[state] = np.zeros(self.num_actions, dtype=np.int64)
+        self.visits[state][action] += 1
+
+    def delta(self):
+        # {state: (values, visits)} of every state updated since the last reset
+        return {state: (list(self.Q[state]), visits.tolist()) for state, visits in self.visits.items()}
+
+
+_worker = None
+
+
+def init_worker(raw_config):
+    global _worker
+    # Workers are quiet, the coordinator reports progress
+    sys.stdout = open(os.devnull, 'w')
+
+    import server
+    _worker = server.Battlesnake(raw_config)
+    learner = _worker.qlearnerStrategy.learner
+    learner.Q = CountingQTable(learner.num_states, learner.num_actions)
+
+
+def run_round(task):
+    table, seeds, width, height, num_snakes = task
+    learner = _worker.qlearnerStrategy.learner
+    learner.Q.Q = {state: np.array(values) for state, values in table.items()}
+    learner.Q.visits = {}
+    random.seed(seeds[0])
+
+    player = sim.ServerPlayer(_worker)
+    turns = 0
+    for seed in seeds:
+        game = sim.Game(width, height, num_snakes, seed=seed, game_id="train-{}".format(seed))
+        game.run([player] * num_snakes)
+        turns += game.turn
+    return learner.Q.delta(), len(seeds), turns
+
+
+def merge(table, deltas):
+    """
+    Merge the worker deltas into the table with the visit-weighted average.
+
+    :param table: The broadcast table, {state: values}, updated in place
+    :type table: dict
+    :param deltas: One {state: (values, visits)} per worker
+    :type deltas: list
+    """
+    weighted = {}
+    counts = {}
+    for delta in deltas:
+        for state, (values, n) in delta.items():
+            n = np.array(n, dtype=np.int64)
+            if state not in weighted:
+                weighted[state] = np.zeros(len(n))
+                counts[state] = np.zeros(len(n), dtype=np.int64)
+            weighted[state] += n * np.array(values)
+            counts[state] += n
+
+    for state, n in counts.items():
+        if state in table:
+            row = np.array(table[state], dtype=float)
+        else:
+            row = np.ones(len(n)) * -1.0
+        visited = n > 0
+        row[visited] = weighted[state][visited] / n[visited]
+        table[state] = row.tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the Q table with parallel self-play games")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--games", type=int, default=10, help="games per worker per round")
+    parser.add_argument("--width", type=int, default=11)
+    parser.add_argument("--height", type=int, default=11)
+    parser.add_argument("--snakes", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rar", type=float, default=0.2, help="random action rate of the workers")
+    parser.add_argument("--config", default="learner.json")
+    parser.add_argument("--init", default=None, help="table to start from, defaults to the Q of the config")
+    parser.add_argument("--out", default="qtable.json")
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        raw_config = json.load(f)
+
+    table = {}
+    init = args.init if args.init is not None else raw_config.get('Q')
+    if init and os.path.isfile(init):
+        with open(init) as f:
+            table = json.load(f)
+
+    # Workers learn from the broadcast table instead of loading one
+    raw_config = copy.deepcopy(raw_config)
+    raw_config['Q'] = None
+    raw_config['rar'] = args.rar
+    runtime = raw_config.setdefault('runtime', {})
+    runtime['is_learning_mode'] = True
+    runtime['dump_at_end'] = False
+
+    start = time.perf_counter()
+    total_games = 0
+    total_turns = 0
+    with Pool(args.workers, initializer=init_worker, initargs=(raw_config,)) as pool:
+        for r in range(args.rounds):
+            tasks = []
+            for w in range(args.workers):
+                first = args.seed + (r * args.workers + w) * args.games
+                tasks.append((table, list(range(first, first + args.games)), args.width, args.height, args.snakes))
+            results = pool.map(run_round, tasks)
+            merge(table, [delta for delta, _, _ in results])
+
+            total_games += sum(games for _, games, _ in results)
+            total_turns += sum(turns for _, _, turns in results)
+            elapsed = time.perf_counter() - start
+            print("Round {}: {} states, {} games, {} turns, {:.0f} games/min".format(
+                r + 1, len(table), total_games, total_turns, total_games / elapsed * 60))
+
+    if args.out.endswith(BINARY_EXTENSION):
+        encoder = util.encoder_id()
+        write_binary(args.out, [int(state) for state in table.keys()], list(table.values()), encoder)
+        print("Writing QTable into {}".format(args.out))
+    else:
+        qtable = QTableMap(len(table), raw_config.get('num_actions', 4))
+        qtable.Q = table
+        print(qtable.dump(args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 import numpy as np
 
+import neighbours
+from GameState import GameState
+
 def discretize(data, num_actions, health_threshold):
     return discretize_possible_routes(data, num_actions, health_threshold)
 
@@ -18,76 +21,71 @@ def isInsideBoundary(y, x, w, h):
 
 # Construct the game board based on data
 def construct_borad(data):
+    return construct_board(GameState.from_data(data))
+
+# Construct the game board based on the game state
+def construct_board(game):
     # 0 = empty
     # 1 = barrier
     # 2 = food
     # 3 = head
     # 4 = my tail
-    board = data['board']
-    h = board['height']
-    w = board['width']
+    h = game.h
+    w = game.w
     states = np.zeros((h, w))
 
-    if 'snakes' in board:
-        for snake in board['snakes']:
-            for pos in snake['body']:
-                if isInsideBoundary(pos['y'], pos['x'], w, h):
-                    states[pos['y'], pos['x']] = 1
-    if 'food' in board:
-        for pos in board['food']:
-            states[pos['y'], pos['x']] = 2
-    you = data['you']
-    for pos in you['body']:
-        if isInsideBoundary(pos['y'], pos['x'], w, h):
-            states[pos['y'], pos['x']] = 1
-    head = you['head']
-    if isInsideBoundary(head['y'], head['x'], w, h):
-        states[head['y'], head['x']] = 3
+    def mark_inside(cells, value):
+        inside = (cells[:, 0] >= 0) & (cells[:, 0] < h) & (cells[:, 1] >= 0) & (cells[:, 1] < w)
+        states[cells[inside, 0], cells[inside, 1]] = value
+
+    mark_inside(game.bodies, 1)
+    states[game.food[:, 0], game.food[:, 1]] = 2
+    you = game.you
+    mark_inside(you.body, 1)
+    head_y, head_x = you.head
+    if isInsideBoundary(head_y, head_x, w, h):
+        states[head_y, head_x] = 3
 
-    if len(you['body']) > 3:
-        states[you['body'][-1]['y'], you['body'][-1]['x']] = 4
+    if len(you.body) > 3:
+        states[you.tail] = 4
 
     return states
 
 # Determine block array
 def determine_block_array(data, states, num_actions):
+    return block_array(GameState.from_data(data), states, num_actions)
+
+def block_array(game, states, num_actions):
     # Block_arr inidicates if there is an immediate block at earch direction. ["up", "down", "left", "right"]
     # This is extra constraint information, not part fo the state
-    board = data['board']
-    h = board['height']
-    w = board['width']
-    you = data['you']
-    head = you['head']
+    h = game.h
+    w = game.w
+    you = game.you
     block_arr = np.zeros(num_actions, dtype=bool)
 
-    tail_map = {}
-    if 'snakes' in board:
-        for snake in board['snakes']:
-            tail_pos = snake['body'][-1]
-            # Don't chase our tail if length too short
-            if snake['id'] == you['id'] and snake['length'] <= 3:
-                continue
-            # Don't chase tail if the snake just got a food
-            if snake['health'] == 100:
-                continue
-            tail_map["{},{}".format(tail_pos['y'], tail_pos['x'])] = True
-
-    def is_tail(y, x):
-        return "{},{}".format(y, x) in tail_map
-
-    direction_pos = (
-        (head['y'] + 1, head['x']),
-        (head['y'] - 1, head['x']),
-        (head['y'], head['x'] - 1),
-        (head['y'], head['x'] + 1)
-    )
-    for i in range(len(direction_pos)):
-        (y, x) = direction_pos[i]
-        if (isInsideBoundary(y, x, w, h) and states[y, x] == 1 and not is_tail(y, x)) or not isInsideBoundary(y, x, w, h):
+    tail_cells = moving_tails(game)
+    flat_states = states.ravel()
+    for i, c in enumerate(neighbours.table(w, h).around(*you.head)):
+        if c == neighbours.OFF_BOARD or (flat_states[c] == 1 and c not in tail_cells):
             block_arr[i] = True
 
     return block_arr
 
+def moving_tails(game):
+    # Linear index of the tails which will move away this turn
+    you = game.you
+    tail_cells = set()
+    for snake in game.snakes:
+        # Don't chase our tail if length too short
+        if snake.id == you.id and snake.length <= 3:
+            continue
+        # Don't chase tail if the snake just got a food
+        if snake.health == 100:
+            continue
+        if isInsideBoundary(snake.tail[0], snake.tail[1], game.w, game.h):
+            tail_cells.add(game.cell(*snake.tail))
+    return tail_cells
+
 # Discretize state based on entire directional area
 def discretize_entire_directional_area(data, num_actions, health_threshold):
     # 0 = empty
@@ -251,20 +249,43 @@ def discretize_possible_routes(data, num_actions, health_threshold):
     block_arr = determine_block_array(data, states, num_actions)
 
     '''
-    Ratio of available blocks in the 3 * 3 area toward of each direction.
-    Area outside of boundary counts as block.
+    Number of possible routes toward each direction.
+    Blocked direction has no routes.
     '''
-    # up
-    up_routes = calculate_possible_routes(head['y'], head['x'], 0, w, h, states)
+    routes = [calculate_possible_routes(head['y'], head['x'], a, w, h, states) for a in range(num_actions)]
 
-    # down
-    down_routes = calculate_possible_routes(head['y'], head['x'], 1, w, h, states)
+    is_dying = 0 if data['you']['health'] > health_threshold else 1
 
-    # left
-    left_routes = calculate_possible_routes(head['y'], head['x'], 2, w, h, states)
+    state_score = encode_possible_routes(routes, food_signals(states, head['y'], head['x'], w, h), is_dying)
 
-    # right
-    right_routes = calculate_possible_routes(head['y'], head['x'], 3, w, h, states)
+    return state_score, block_arr
+
+def food_signals(states, head_y, head_x, w, h):
+    '''
+    Food signal for four directions (0-1)
+    :return: (up, down, left, right) food signals
+    :rtype: tuple
+    '''
+    up_food = 1 if np.sum(states[head_y + 1 : h, :] == 2) > 0 else 0
+    down_food = 1 if np.sum(states[0 : head_y - 1, :] == 2) > 0 else 0
+    left_food = 1 if np.sum(states[:, 0 : head_x - 1] == 2) > 0 else 0
+    right_food = 1 if np.sum(states[:, head_x + 1 : w] == 2) > 0 else 0
+    return up_food, down_food, left_food, right_food
+
+def encode_possible_routes(routes, food_signals, is_dying):
+    '''
+    Encode the directional routes, food signals and low health indicator into a state
+    :param routes: number of routes toward ["up", "down", "left", "right"]
+    :type routes: list
+    :param food_signals: food signal toward ["up", "down", "left", "right"]
+    :type food_signals: tuple
+    :param is_dying: low health indicator (0-1)
+    :type is_dying: int
+    :return: the state
+    :rtype: int
+    '''
+    up_routes, down_routes, left_routes, right_routes = routes
+    up_food, down_food, left_food, right_food = food_signals
 
     sum_routes = up_routes + down_routes + left_routes + right_routes + 1
     up_ratio = up_routes / sum_routes
@@ -272,18 +293,10 @@ def discretize_possible_routes(data, num_actions, health_threshold):
     left_ratio = left_routes / sum_routes
     right_ratio = right_routes / sum_routes
 
-    is_dying = 0 if data['you']['health'] > health_threshold else 1
-
-    up_food = 1 if np.sum(states[head['y'] + 1 : h, :] == 2) > 0 else 0
-    down_food = 1 if np.sum(states[0 : head['y'] - 1, :] == 2) > 0 else 0
-    left_food = 1 if np.sum(states[:, 0 : head['x'] - 1] == 2) > 0 else 0
-    right_food = 1 if np.sum(states[:, head['x'] + 1 : w] == 2) > 0 else 0
-
     state_score = round(up_ratio * 10 - 0.5) + round(down_ratio * 10 - 0.5) * pow(10, 1) + round(left_ratio * 10 - 0.5) * pow(10, 2) + round(right_ratio * 10 - 0.5) * pow(10, 3)
     state_score += up_food * pow(10, 4) * pow(2, 1) + down_food * pow(10, 4) * pow(2, 2) + left_food * pow(10, 4) * pow(2, 3)  + right_food * pow(10, 4) * pow(2, 4)
     state_score += is_dying * pow(10, 4) * pow(2, 5)
-
-    return state_score, block_arr
+    return state_score
 
 def calculate_possible_routes(head_y, head_x, dirr, w, h, states):
     '''
@@ -298,55 +311,39 @@ def calculate_possible_routes(head_y, head_x, dirr, w, h, states):
     :rtype: int
 
     '''
-    def getAvailableNext(pos):
-        possible_nears = []
-        if isInsideBoundary(pos[0] + 1, pos[1], w, h) and states[pos[0] + 1, pos[1]] not in (1, 3):
-            possible_nears.append((pos[0] + 1, pos[1]))
-        if isInsideBoundary(pos[0] - 1, pos[1], w, h) and states[pos[0] - 1, pos[1]] not in (1, 3):
-            possible_nears.append((pos[0] - 1, pos[1]))
-        if isInsideBoundary(pos[0], pos[1] - 1, w, h) and states[pos[0], pos[1] - 1] not in (1, 3):
-            possible_nears.append((pos[0], pos[1] - 1))
-        if isInsideBoundary(pos[0], pos[1] + 1, w, h) and states[pos[0], pos[1] + 1] not in (1, 3):
-            possible_nears.append((pos[0], pos[1] + 1))
-        return possible_nears
-
-    if dirr == 0:
-        root_y = head_y + 1
-        root_x = head_x
-    elif dirr == 1:
-        root_y = head_y - 1
-        root_x = head_x
-    elif dirr == 2:
-        root_y = head_y
-        root_x = head_x - 1
-    else:
-        root_y = head_y
-        root_x = head_x + 1
-
-    if not isInsideBoundary(root_y, root_x, w, h ) or states[root_y, root_x] == 1:
+    nears = neighbours.table(w, h)
+    root = nears.around(head_y, head_x)[dirr]
+    flat_states = states.ravel()
+    if root == neighbours.OFF_BOARD or flat_states[root] == 1:
         return 0
 
+    free = ((flat_states != 1) & (flat_states != 3)).tolist()
     total_routes = 0
-    queue = [] # list of position
-    visited = {} # {position : count}
-    root = (root_y, root_x)
-    queue.append(root)
-    visited.update({root : 1})
-    while len(queue) != 0:
-        pos = queue.pop(0)
+    queue = [root] # linear index of the cells, read from the front with head
+    visited = [0] * (w * h) # count of every cell, 0 until visited
+    visited[root] = 1
+    head = 0
+    while head < len(queue):
+        pos = queue[head]
+        head += 1
         pos_count = visited[pos]
-        nears = getAvailableNext(pos)
-        for near in nears:
-            if near in visited:
-                visited.update({near : visited[near] + pos_count})
+        for near in nears.rows[pos]:
+            if near == neighbours.OFF_BOARD or not free[near]:
+                continue
+            if visited[near]:
+                visited[near] += pos_count
             else:
                 queue.append(near)
-                visited.update({near : pos_count})
+                visited[near] = pos_count
             total_routes = max(total_routes, visited[near])
 
     return total_routes
 
 # Helper methods
+def encoder_id():
+    # ID of the state encoder used by discretize, recorded in binary Q tables
+    return "possible_routes-bfs"
+
 def unique_id(data):
     # concat game_id with you_id
     game_id = data['game']['id']
@@ -0,0 +1,263 @@
+"""
+Multi-process serving: worker processes accept the requests of one listening
+socket and read one Q table in shared memory.
+
+The supervisor binds the socket, creates the QTableShared and forks:
+
+- one writer process in learning mode, which loads the table, learns from the
+  experiences the workers send through a queue and persists the table. It is
+  the only process writing the table. A restarted writer keeps the live table
+  instead of loading it again. Without learning the supervisor loads the table
+  before forking and nobody writes it.
+- the worker processes, each serving server.Battlesnake with CherryPy.
+
+With the 'socket' dispatch the workers accept from the inherited socket and
+the kernel hands every connection to one of them. The sessions of the games
+live in the worker which served the request, requests of one game landing on
+another worker continue the game as if its start had been missed.
+
+With the 'affinity' dispatch a dispatcher process accepts from the socket and
+forwards all the requests of a game to one worker over its Unix socket (see
+Dispatcher.py), keeping the checkpoint of every session so a restarted
+worker continues its games.
+
+Processes which die are started again.
+
+    "runtime": {"workers": {"processes": 4, "dispatch": "affinity"}}
+"""
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import socket
+import tempfile
+import time
+
+import cherrypy
+from cherrypy._cpwsgi_server import CPWSGIServer
+from cherrypy.process.plugins import Monitor
+from cherrypy.process.servers import ServerAdapter
+
+import config as cf
+import eventlog
+import QLearnerStrategy as qs
+from Dispatcher import Dispatcher
+from QTableShared import QTableShared, QTableUpdates, SNAPSHOT
+from server import Battlesnake
+
+# Sockets and shared memory are inherited by forking
+_context = multiprocessing.get_context('fork')
+
+
+class SharedSocketServer(CPWSGIServer):
+    """
+    CherryPy HTTP server accepting from a listening socket shared with other processes.
+
+    :param server_adapter: The settings of the server, cherrypy.server
+    :type server_adapter: cherrypy._cpserver.Server
+    :param listener: The bound and listening socket
+    :type listener: socket.socket
+    """
+    def __init__(self, server_adapter, listener):
+        super().__init__(server_adapter)
+        self.listener = listener
+
+    def bind(self, family, type, proto=0):
+        # Accept from the inherited socket instead of binding a new one
+        self.socket = self.listener
+        self.bind_addr = self.listener.getsockname()
+        return self.socket
+
+
+def serve_app(app, listener, supervisor):
+    """
+    Serve app with CherryPy until SIGTERM or the supervisor exits
+
+    :param listener: The shared listening socket, or the path of a Unix socket of this process
+    :type listener: socket.socket or str
+    :param supervisor: Process ID of the supervisor
+    :type supervisor: int
+    """
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, lambda signum, frame: cherrypy.engine.exit())
+
+    cherrypy.config.update({"engine.autoreload.on": False})
+    cherrypy.tree.mount(app, '')
+    if isinstance(listener, str):
+        cherrypy.server.bind_addr = listener
+    else:
+        cherrypy.server.unsubscribe()
+        ServerAdapter(cherrypy.engine, SharedSocketServer(cherrypy.server, listener)).subscribe()
+
+    def orphaned():
+        if os.getppid() != supervisor:
+            cherrypy.engine.exit()
+    Monitor(cherrypy.engine, orphaned, frequency=1).subscribe()
+
+    cherrypy.engine.start()
+    cherrypy.engine.block()
+
+
+def run_worker(raw_config, listener, table, updates, supervisor):
+    server = Battlesnake(raw_config, table, updates)
+    cherrypy.engine.subscribe('stop', server.stop)
+    eventlog.info("worker_start", pid=os.getpid())
+    serve_app(server, listener, supervisor)
+
+
+def run_dispatcher(raw_config, listener, paths, supervisor):
+    eventlog.configure(cf.LoggingConfig(raw_config))
+    session_config = cf.SessionConfig(raw_config)
+    dispatcher = Dispatcher(paths, session_config.ttl, session_config.max_sessions,
+                            cf.RuntimeConfig(raw_config).network_margin_ms)
+    cherrypy.engine.subscribe('stop', eventlog.stop)
+    eventlog.info("dispatcher_start", pid=os.getpid(), workers=len(paths))
+    serve_app(dispatcher, listener, supervisor)
+
+
+def run_writer(raw_config, table, updates, ready, supervisor):
+    """
+    Load the shared table unless a previous writer did, then learn from the
+    experiences of the workers until the supervisor sends None or exits
+    """
+    # The supervisor stops the writer once the workers stopped sending
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    strategy = qs.QLearnerStrategy(raw_config, table)
+    ready.set()
+    learned = 0
+    full = False
+    while os.getppid() == supervisor:
+        try:
+            message = updates.get(timeout=1.0)
+        except queue.Empty:
+            continue
+        if message is None:
+            break
+        if message == SNAPSHOT:
+            if strategy.store is not None:
+                strategy.store.request_snapshot()
+            continue
+        try:
+            strategy.learner.learn(*message)
+            learned += 1
+        except ValueError as e:
+            if not full:
+                eventlog.error("qtable_full", error=str(e))
+            full = True
+    strategy.stop()
+    eventlog.info("writer_stop", learned=learned, rows=len(table))
+    eventlog.stop()
+
+
+def serve(raw_config, host, port):
+    """
+    Serve with the worker processes until SIGTERM or SIGINT
+
+    :param raw_config: The content of learner.json
+    :type raw_config: dict
+    :param host: Address to listen on
+    :type host: str
+    :param port: Port to listen on
+    :type port: int
+    """
+    eventlog.configure(cf.LoggingConfig(raw_config))
+    workers_config = cf.WorkersConfig(raw_config)
+    learner_config = cf.LearnerConfig(raw_config)
+    learning = cf.RuntimeConfig(raw_config).is_learning_mode
+    processes = workers_config.processes or os.cpu_count()
+    supervisor = os.getpid()
+    if workers_config.dispatch not in ('socket', 'affinity'):
+        raise ValueError("Unknown dispatch {}, expected 'socket' or 'affinity'".format(workers_config.dispatch))
+    affinity = workers_config.dispatch == 'affinity'
+
+    listener = socket.create_server((host, port), backlog=128)
+    socket_dir = None
+    paths = None
+    if affinity:
+        socket_dir = tempfile.mkdtemp(prefix="battlesnake-")
+        paths = [os.path.join(socket_dir, "worker-{}.sock".format(n)) for n in range(processes)]
+    table = QTableShared(learner_config.num_states, learner_config.num_actions, workers_config.capacity)
+    updates = _context.Queue(workers_config.queue_size)
+    ready = _context.Event()
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+    def start_writer():
+        writer = _context.Process(target=run_writer, name="battlesnake-writer",
+                                  args=(raw_config, table, updates, ready, supervisor))
+        writer.start()
+        return writer
+
+    def start_worker(n):
+        worker = _context.Process(target=run_worker, name="battlesnake-worker-{}".format(n),
+                                  args=(raw_config, paths[n] if affinity else listener, table, QTableUpdates(updates), supervisor))
+        worker.start()
+        return worker
+
+    def start_dispatcher():
+        dispatcher = _context.Process(target=run_dispatcher, name="battlesnake-dispatcher",
+                                      args=(raw_config, listener, paths, supervisor))
+        dispatcher.start()
+        return dispatcher
+
+    writer = None
+    dispatcher = None
+    workers = []
+    try:
+        if learning:
+            writer = start_writer()
+            while not ready.wait(1.0):
+                if not writer.is_alive():
+                    raise RuntimeError("The Q table writer exited with {}".format(writer.exitcode))
+        else:
+            # Nobody learns, the table is loaded once before forking the readers
+            qs.QLearnerStrategy(raw_config, table)
+        workers = [start_worker(n) for n in range(processes)]
+        if affinity:
+            dispatcher = start_dispatcher()
+        eventlog.info("workers_start", processes=processes, port=port, dispatch=workers_config.dispatch,
+                      learning=learning, capacity=table.capacity)
+
+        while not stopping:
+            time.sleep(0.5)
+            if stopping:
+                break
+            for n, worker in enumerate(workers):
+                if not worker.is_alive():
+                    eventlog.warning("worker_restart", worker=n, pid=worker.pid, exitcode=worker.exitcode)
+                    workers[n] = start_worker(n)
+            if writer is not None and not writer.is_alive():
+                eventlog.warning("writer_restart", pid=writer.pid, exitcode=writer.exitcode)
+                writer = start_writer()
+            if dispatcher is not None and not dispatcher.is_alive():
+                eventlog.warning("dispatcher_restart", pid=dispatcher.pid, exitcode=dispatcher.exitcode)
+                dispatcher = start_dispatcher()
+    finally:
+        # The dispatcher first, it stops forwarding to the workers
+        if dispatcher is not None:
+            dispatcher.terminate()
+            dispatcher.join(10)
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join(10)
+            if worker.is_alive():
+                worker.kill()
+                worker.join()
+        if writer is not None:
+            # Queued after the last experience of the workers
+            updates.put(None)
+            writer.join()
+        updates.close()
+        listener.close()
+        table.close()
+        table.unlink()
+        if socket_dir is not None:
+            shutil.rmtree(socket_dir, ignore_errors=True)
+        eventlog.info("workers_stop", processes=processes)
+        eventlog.stop()